@@ -1,5 +1,8 @@
 from .nodes import *
 from .io import *
+from .sweep import *
+from .stream import ChiveStream, resumed_chunks
+from .replicate import current_replicate
 import pytest
 
 
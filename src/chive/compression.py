@@ -0,0 +1,103 @@
+import contextlib
+from pathlib import Path
+from typing import *
+
+
+# Compressed checkpoints start with this magic, a length byte and the codec name, so
+# loads can pick the codec without being told. Files without it are uncompressed.
+MAGIC: Final[bytes] = b"\x93CHIVE"
+
+
+class Codec(NamedTuple):
+    # Both take an open binary file object and return a file-like wrapper around it
+    writer: Callable[[IO[bytes]], IO[bytes]]
+    reader: Callable[[IO[bytes]], IO[bytes]]
+
+
+def _gzip_codec() -> Codec:
+    import gzip
+
+    return Codec(
+        writer=lambda f: gzip.GzipFile(fileobj=f, mode="wb"),
+        reader=lambda f: gzip.GzipFile(fileobj=f, mode="rb"),
+    )
+
+
+def _bz2_codec() -> Codec:
+    import bz2
+
+    return Codec(
+        writer=lambda f: bz2.BZ2File(f, mode="wb"),
+        reader=lambda f: bz2.BZ2File(f, mode="rb"),
+    )
+
+
+def _lzma_codec() -> Codec:
+    import lzma
+
+    return Codec(
+        writer=lambda f: lzma.LZMAFile(f, mode="wb"),
+        reader=lambda f: lzma.LZMAFile(f, mode="rb"),
+    )
+
+
+def _zstd_codec() -> Codec:
+    import zstandard
+
+    return Codec(
+        writer=lambda f: zstandard.ZstdCompressor().stream_writer(f, closefd=False),
+        reader=lambda f: zstandard.ZstdDecompressor().stream_reader(f, closefd=False),
+    )
+
+
+# Factories, so that codec modules are only imported when a codec is used
+CODECS: Dict[str, Callable[[], Codec]] = {
+    "gzip": _gzip_codec,
+    "bz2": _bz2_codec,
+    "lzma": _lzma_codec,
+    "zstd": _zstd_codec,
+}
+
+
+def register_codec(name: str, writer, reader):
+    if not 0 < len(name.encode()) < 256:
+        raise ValueError(f"Invalid codec name {name!r}")
+    CODECS[name] = lambda: Codec(writer=writer, reader=reader)
+
+
+def get_codec(name: str) -> Codec:
+    try:
+        factory = CODECS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown compression {name!r}, expected one of {sorted(CODECS)}"
+        ) from None
+    return factory()
+
+
+@contextlib.contextmanager
+def open_write(path: str | Path, compress: Optional[str] = None):
+    """Open path for streaming writes, compressing with the given codec if any."""
+    with open(path, "wb") as f:
+        if not compress:
+            yield f
+            return
+        codec = get_codec(compress)
+        name = compress.encode()
+        f.write(MAGIC + bytes([len(name)]) + name)
+        with codec.writer(f) as stream:
+            yield stream
+
+
+@contextlib.contextmanager
+def open_read(path: str | Path):
+    """Open path for streaming reads, detecting the codec from the file header."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            f.seek(0)
+            yield f
+            return
+        name = f.read(f.read(1)[0]).decode()
+        with get_codec(name).reader(f) as stream:
+            yield stream
+
@@ -0,0 +1,56 @@
+import os
+import pickle
+from typing import *
+
+from .io import CHIVE_DIR, _tmp_path
+
+CONFIG_CACHE: Final[str] = f"{CHIVE_DIR}/configs.pkl"
+
+# Parsed configs by (path, mtime, size), shared by every session in this process
+_parsed: Dict[Tuple[str, int, int], dict] = {}
+
+
+def load_config(path: str, cache_path: str = CONFIG_CACHE) -> dict:
+    """
+    Parse a chive YAML config file.
+
+    Results are cached in memory and in cache_path, keyed by the file's path, mtime and
+    size, so an unchanged config is never parsed (nor yaml imported) again.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key in _parsed:
+        return _parsed[key]
+    cache = _read_cache(cache_path)
+    if key not in cache:
+        import yaml
+
+        with open(path) as f:
+            cfg = yaml.safe_load(f) or {}
+        # Only the current version of each file is worth keeping
+        cache = {k: v for k, v in cache.items() if k[0] != key[0]}
+        cache[key] = cfg
+        _write_cache(cache_path, cache)
+    _parsed[key] = cache[key]
+    return cache[key]
+
+
+def _read_cache(cache_path: str) -> dict:
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+    except Exception:
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _write_cache(cache_path: str, cache: dict):
+    # The cache is only an optimization; never fail a session over it
+    try:
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        tmp_path = _tmp_path(cache_path)
+        with open(tmp_path, "wb") as f:
+            pickle.dump(cache, f)
+        os.replace(tmp_path, cache_path)
+    except (OSError, pickle.PicklingError):
+        pass
@@ -0,0 +1,116 @@
+import hashlib
+import inspect
+import json
+import os
+from pathlib import Path
+from typing import *
+
+from .io import CHIVE_DIR, ChiveIO, _canonicalize, _function_fingerprint, _tmp_path
+from .plan import plan_item
+
+OUTCOMES_PATH: Final[str] = f"{CHIVE_DIR}/outcomes.json"
+
+
+class ChiveOutcomes:
+    """
+    Outcomes of output tests, each recorded with a fingerprint of everything it read:
+    the code of the test and of every fixture it uses, its parameters, and the content
+    of the checkpoints it loads. A test whose fingerprint matches the one recorded
+    with its last pass (or skip) needn't run again.
+
+    Only tests whose checkpoints all exist can be fingerprinted before they run, and
+    fixtures that read data from elsewhere are only tracked through their code.
+    """
+
+    def __init__(self, io: ChiveIO, path: str = OUTCOMES_PATH):
+        self.io = io
+        self.path = path
+        self.records: Dict[str, dict] = {}
+        # Content digests of checkpoint files, by path, with the mtime and size they
+        # were computed for
+        self.digests: Dict[str, Tuple[int, int, str]] = {}
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self.records = data["records"]
+            self.digests = {k: tuple(v) for k, v in data["digests"].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def fingerprint(self, item, force_recompute: bool = False) -> Optional[str]:
+        """Fingerprint of an item's inputs, or None if they aren't all on disk yet."""
+        h = hashlib.sha256()
+        h.update(f"{item.nodeid}\0{_function_fingerprint(item.function)}".encode())
+        try:
+            params = item.callspec.params
+        except AttributeError:
+            params = {}
+        h.update(_canonicalize(params).encode())
+        name2fixturedefs = item._fixtureinfo.name2fixturedefs
+        for name in sorted(set(item.fixturenames) - set(params)):
+            fixturedefs = name2fixturedefs.get(name)
+            if fixturedefs:
+                fixturedef = fixturedefs[-1]
+                # During setup the func may have been swapped for a ChivePlugin wrapper
+                func = getattr(fixturedef, "_chive_old_func", fixturedef.func)
+                func = inspect.unwrap(func)
+                h.update(f"\0{name}\0{_function_fingerprint(func)}".encode())
+        for node in plan_item(item, self.io, force_recompute):
+            if not node.checkpoint:
+                continue
+            found = node.action == "load" and self.io.find(
+                f"{CHIVE_DIR}/{node.name}/{node.key}/{node.name}"
+            )
+            if not found:
+                return None
+            h.update(f"\0{node.name}\0{self._digest(found[1])}".encode())
+        return h.hexdigest()
+
+    def cached(self, nodeid: str, fingerprint: Optional[str]) -> Optional[dict]:
+        """An item's last record, if it passed or skipped with the same inputs."""
+        record = self.records.get(nodeid)
+        if fingerprint is None or record is None:
+            return None
+        if record["fingerprint"] != fingerprint or record["outcome"] == "failed":
+            return None
+        return record
+
+    def record(self, nodeid: str, fingerprint: Optional[str], outcome: str, **details):
+        if fingerprint is None:
+            self.records.pop(nodeid, None)
+        else:
+            self.records[nodeid] = {
+                "fingerprint": fingerprint,
+                "outcome": outcome,
+                **details,
+            }
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Forget digests of checkpoints that have since been deleted
+        digests = {k: v for k, v in self.digests.items() if os.path.exists(k)}
+        tmp_path = _tmp_path(self.path)
+        with open(tmp_path, "w") as f:
+            json.dump({"records": self.records, "digests": digests}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def _digest(self, path: Path) -> str:
+        files = sorted(path.rglob("*")) if path.is_dir() else [path]
+        h = hashlib.sha256()
+        for file in files:
+            if file.is_file():
+                h.update(f"\0{file.relative_to(path.parent)}\0".encode())
+                h.update(self._file_digest(file).encode())
+        return h.hexdigest()
+
+    def _file_digest(self, file: Path) -> str:
+        stat = file.stat()
+        cached = self.digests.get(str(file))
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        h = hashlib.sha256()
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                h.update(block)
+        self.digests[str(file)] = (stat.st_mtime_ns, stat.st_size, h.hexdigest())
+        return h.hexdigest()
@@ -0,0 +1,194 @@
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import *
+
+from .io import CHIVE_DIR, MANIFEST_NAME, ChiveIO, _disk_size, _remove
+
+INDEX_NAME = "index.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    save_name TEXT PRIMARY KEY,
+    node TEXT,
+    key TEXT,
+    params TEXT,
+    format TEXT,
+    size INTEGER,
+    created REAL,
+    accessed REAL,
+    code TEXT
+)
+"""
+_COLUMNS = "save_name, node, key, params, format, size, created, accessed, code"
+
+
+class ChiveIndexEntry(NamedTuple):
+    save_name: str
+    node: Optional[str]
+    key: Optional[str]
+    params: Dict[str, str]
+    format: Optional[str]
+    size: int
+    created: float
+    accessed: float
+    code: Optional[str]
+
+
+def _normalize(save_name: str | Path) -> str:
+    return os.path.normpath(save_name)
+
+
+class ChiveIndex:
+    """
+    SQLite index of the checkpoints saved under the checkpoint directory, with their
+    manifest details, size, and when they were created and last loaded.
+
+    ChiveIO consults it before touching the filesystem, so looking up a checkpoint is
+    a single query and a stat of the one file it names. Checkpoints missing from the
+    index (e.g. saved by an older version) are still found on disk, and sync adds them.
+    """
+
+    def __init__(
+        self, path: str | Path = f"{CHIVE_DIR}/{INDEX_NAME}", timeout: float = 30.0
+    ):
+        self.path = Path(path)
+        self.timeout = timeout
+        self._conn: Optional["sqlite3.Connection"] = None
+        # Writer threads save checkpoints while the main thread loads them
+        self._lock = threading.Lock()
+
+    def _connect(self) -> "sqlite3.Connection":
+        if self._conn is None:
+            import sqlite3
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(
+                self.path, timeout=self.timeout, check_same_thread=False
+            )
+            with self._conn:
+                self._conn.execute(_SCHEMA)
+        return self._conn
+
+    def _execute(self, sql: str, args: Sequence = ()) -> List[tuple]:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(sql, args).fetchall()
+
+    def get(self, save_name: str | Path) -> Optional[ChiveIndexEntry]:
+        rows = self._execute(
+            f"SELECT {_COLUMNS} FROM checkpoints WHERE save_name = ?",
+            (_normalize(save_name),),
+        )
+        return self._entry(rows[0]) if rows else None
+
+    def record(self, save_name: str | Path, manifest: dict, size: int):
+        now = time.time()
+        self._execute(
+            f"INSERT OR REPLACE INTO checkpoints ({_COLUMNS}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                _normalize(save_name),
+                manifest.get("node"),
+                manifest.get("key"),
+                json.dumps(manifest.get("params", {}), sort_keys=True),
+                manifest.get("format"),
+                size,
+                now,
+                now,
+                manifest.get("code"),
+            ),
+        )
+
+    def touch(self, save_name: str | Path):
+        self._execute(
+            "UPDATE checkpoints SET accessed = ? WHERE save_name = ?",
+            (time.time(), _normalize(save_name)),
+        )
+
+    def remove(self, save_name: str | Path):
+        self._execute(
+            "DELETE FROM checkpoints WHERE save_name = ?", (_normalize(save_name),)
+        )
+
+    def entries(self) -> List[ChiveIndexEntry]:
+        """All indexed checkpoints, least recently accessed first."""
+        rows = self._execute(
+            f"SELECT {_COLUMNS} FROM checkpoints ORDER BY accessed, save_name"
+        )
+        return [self._entry(row) for row in rows]
+
+    def sync(self, io: ChiveIO, root: str | Path = CHIVE_DIR):
+        """
+        Bring the index in line with what is on disk: index checkpoints it doesn't know
+        about and forget ones whose files have gone. This walks the whole directory.
+        """
+        for entry in self.entries():
+            path = Path(f"{entry.save_name}{entry.format}")
+            if entry.format is None or not path.exists():
+                self.remove(entry.save_name)
+        for manifest_path in Path(root).glob(f"**/{MANIFEST_NAME}"):
+            manifest = io.read_manifest(manifest_path.parent)
+            if not manifest or "node" not in manifest:
+                continue
+            save_name = manifest_path.parent / manifest["node"]
+            if self.get(save_name) is not None:
+                continue
+            found = io.find(save_name)
+            if found is None:
+                continue
+            fmt, path = found
+            stat = path.stat()
+            size = _disk_size(path)
+            self.record(save_name, {**manifest, "format": fmt.extension}, size)
+            # The best guesses available for checkpoints saved before indexing
+            self._execute(
+                "UPDATE checkpoints SET created = ?, accessed = ? WHERE save_name = ?",
+                (
+                    stat.st_mtime,
+                    max(stat.st_atime, stat.st_mtime),
+                    _normalize(save_name),
+                ),
+            )
+
+    def gc(self, io: ChiveIO, max_bytes: int) -> List[ChiveIndexEntry]:
+        """
+        Delete least recently used checkpoints until the rest fit in max_bytes.
+        Returns the entries that were removed.
+        """
+        self.sync(io)
+        entries = self.entries()
+        total = sum(entry.size for entry in entries)
+        removed = []
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            save_name = Path(entry.save_name)
+            _remove(Path(f"{save_name}{entry.format}"))
+            (save_name.parent / MANIFEST_NAME).unlink(missing_ok=True)
+            try:
+                save_name.parent.rmdir()
+            except OSError:
+                # Something else lives there too, e.g. a lock or saved figures
+                pass
+            self.remove(save_name)
+            total -= entry.size
+            removed.append(entry)
+        return removed
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @staticmethod
+    def _entry(row: tuple) -> ChiveIndexEntry:
+        save_name, node, key, params, fmt, size, created, accessed, code = row
+        params = json.loads(params or "{}")
+        return ChiveIndexEntry(
+            save_name, node, key, params, fmt, size, created, accessed, code
+        )
@@ -1,63 +1,1026 @@
-from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+import contextlib
+import functools
+import hashlib
+import importlib.util
+import inspect
+import json
+import mmap
+import os
 from pathlib import Path
 import pickle
+import posixpath
+import shutil
+import struct
+import sys
+import textwrap
+import threading
+import time
+import tokenize
+import traceback
 from typing import *
 
+from .compression import get_codec, open_read, open_write
+from .stream import ChiveStream, _resuming
+
+
+CHIVE_DIR: Final[str] = ".chive"
+MANIFEST_NAME: Final[str] = "manifest.json"
+# Appended to a checkpoint's save name for the record of its last failed computation
+FAILURE_SUFFIX: Final[str] = ".failed.json"
+
+
+def _is_type(obj, *qualnames: str) -> bool:
+    """
+    Whether obj's type is exactly one of the types named by their import paths, without
+    importing them. If the defining module has not been imported, obj cannot be one.
+    Subclasses don't count, since formats would load them back as their base type.
+    """
+    for qualname in qualnames:
+        module, _, name = qualname.rpartition(".")
+        mod = sys.modules.get(module)
+        if mod is not None and type(obj) is getattr(mod, name, None):
+            return True
+    return False
+
+
+def _tmp_path(path: str | Path) -> Path:
+    """Unique sibling of path for atomic writes. Keeps the suffix, which some writers require."""
+    path = Path(path)
+    return path.with_name(f".{path.stem}.{os.urandom(6).hex()}.tmp{path.suffix}")
+
+
+def _fsync(path: Path):
+    for file in path.rglob("*") if path.is_dir() else [path]:
+        if file.is_file():
+            fd = os.open(file, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+class ChiveFormat:
+    """
+    Serialization handler for checkpoints of a particular type. Subclasses set the
+    file extension and implement match/save/load, and are selected in registration
+    order when saving. Loading selects the handler by the extension found on disk.
+    """
+
+    extension: str = ""
+
+    def match(self, obj) -> bool:
+        raise NotImplementedError
+
+    def save(self, obj, path: Path):
+        raise NotImplementedError
+
+    def load(self, path: Path):
+        raise NotImplementedError
+
+
+class StreamFormat(ChiveFormat):
+    """
+    Format that reads and writes through a file object, which lets ChiveIO stream it
+    through a compression codec. Subclasses implement dump/read instead of save/load.
+    """
+
+    def dump(self, obj, f: IO[bytes]):
+        raise NotImplementedError
+
+    def read(self, f: IO[bytes]):
+        raise NotImplementedError
+
+    def save(self, obj, path, compress: Optional[str] = None):
+        with open_write(path, compress) as f:
+            self.dump(obj, f)
+
+    def load(self, path):
+        with open_read(path) as f:
+            return self.read(f)
+
+
+class PickleFormat(StreamFormat):
+    extension = ".pkl"
+
+    def match(self, obj):
+        return True
+
+    def dump(self, obj, f):
+        pickle.dump(obj, f)
+
+    def read(self, f):
+        return pickle.load(f)
+
+
+class BufferedPickleFormat(ChiveFormat):
+    """
+    Pickle protocol 5 with out-of-band buffers, such as the data of numpy arrays,
+    stored after the pickle and aligned. Loading memory-maps the file copy-on-write
+    and hands those buffers to the unpickled objects, so large data isn't copied.
+    Not compressible, so it is only used when chosen explicitly.
+    """
+
+    extension = ".pkl5"
+    MAGIC: Final[bytes] = b"\x93CHIVEP5"
+    ALIGN: Final[int] = 64
+
+    def match(self, obj):
+        return True
+
+    def save(self, obj, path):
+        buffers: List[pickle.PickleBuffer] = []
+        data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        views = [buffer.raw() for buffer in buffers]
+        header = struct.Struct(f"<{2 + 2 * len(views)}Q")
+        offset = len(self.MAGIC) + header.size + len(data)
+        table = []
+        for view in views:
+            offset = -(-offset // self.ALIGN) * self.ALIGN
+            table += [offset, view.nbytes]
+            offset += view.nbytes
+        with open(path, "wb") as f:
+            f.write(self.MAGIC)
+            f.write(header.pack(len(data), len(views), *table))
+            f.write(data)
+            for view, offset in zip(views, table[::2]):
+                f.seek(offset)
+                f.write(view)
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        if mapped[: len(self.MAGIC)] != self.MAGIC:
+            raise ValueError(f"{path} is not a {self.extension} checkpoint")
+        view = memoryview(mapped)
+        start = len(self.MAGIC)
+        length, count = struct.unpack_from("<2Q", mapped, start)
+        table = struct.unpack_from(f"<{2 * count}Q", mapped, start + 16)
+        start += 16 + 16 * count
+        # The views keep the mapping open for as long as the objects using them live
+        buffers = [view[o : o + n] for o, n in zip(table[::2], table[1::2])]
+        return pickle.loads(view[start : start + length], buffers=buffers)
+
+
+class NumpyFormat(ChiveFormat):
+    extension = ".npy"
+
+    # Loaded arrays are mapped copy-on-write: writable, without changing the file
+    def __init__(self, mmap_mode: Optional[str] = "c"):
+        self.mmap_mode = mmap_mode
+
+    def match(self, obj):
+        # Memory-mapped arrays are plain arrays once loaded from a checkpoint
+        return (
+            _is_type(obj, "numpy.ndarray", "numpy.memmap") and not obj.dtype.hasobject
+        )
+
+    def save(self, obj, path):
+        import numpy as np
+
+        np.save(path, obj, allow_pickle=False)
+
+    def load(self, path):
+        import numpy as np
+
+        return np.load(path, mmap_mode=self.mmap_mode, allow_pickle=False)
+
+
+class ParquetFormat(ChiveFormat):
+    extension = ".parquet"
+
+    def match(self, obj):
+        return (
+            _is_type(obj, "pandas.DataFrame")
+            and importlib.util.find_spec("pyarrow") is not None
+        )
+
+    def save(self, obj, path):
+        obj.to_parquet(path)
+
+    def load(self, path):
+        import pandas as pd
+
+        return pd.read_parquet(path)
+
+
+class AnnDataFormat(ChiveFormat):
+    extension = ".h5ad"
+
+    def __init__(self, backed: Optional[str] = "r"):
+        self.backed = backed
+
+    def match(self, obj):
+        return _is_type(obj, "anndata.AnnData")
+
+    def save(self, obj, path):
+        obj.write_h5ad(path)
+
+    def load(self, path):
+        import anndata
+
+        return anndata.read_h5ad(path, backed=self.backed)
+
+
+class ChunksFormat(ChiveFormat):
+    """
+    A streaming checkpoint: a directory holding one file per chunk, each saved in
+    whichever format suits it, which loads as a ChiveStream reading them in order.
+    """
+
+    extension = ".chunks"
+
+    def match(self, obj):
+        # Only ever written chunk by chunk, through ChiveIO.save_stream
+        return False
+
+    def load(self, path):
+        files = _chunk_files(path)
+
+        def chunks():
+            formats = {fmt.extension: fmt for fmt in FORMATS}
+            for file in files:
+                yield formats[file.suffix].load(file)
+
+        return ChiveStream(chunks, length=len(files))
+
+
+class ReplicatesFormat(ChunksFormat):
+    """Independent replicates of a checkpoint, one file each, loaded as a list."""
+
+    extension = ".replicates"
+
+    def load(self, path):
+        return list(super().load(path))
+
+
+# Checked in order when saving; the pickle fallback must stay last, so that formats
+# after it are only ever used to load checkpoints or when chosen explicitly
+FORMATS: List[ChiveFormat] = [
+    NumpyFormat(),
+    ParquetFormat(),
+    AnnDataFormat(),
+    ChunksFormat(),
+    ReplicatesFormat(),
+    PickleFormat(),
+    BufferedPickleFormat(),
+]
+
+
+def register_format(fmt: ChiveFormat, index: int = 0):
+    """
+    Register a checkpoint format. By default it takes precedence over all formats
+    registered before it.
+    """
+    if not fmt.extension:
+        raise ValueError(f"{type(fmt).__name__} must define a file extension")
+    for existing in list(FORMATS):
+        if existing.extension == fmt.extension:
+            FORMATS.remove(existing)
+    FORMATS.insert(index, fmt)
+
 
 class ChiveIO:
     def __init__(self):
-        pass
+        # Called as observer(op, save_name) around each save and load, returning a
+        # context manager whose value is a dict the operation can add details to
+        self.observer: Optional[Callable[[str, str], ContextManager[dict]]] = None
+        # Index of saved checkpoints (a ChiveIndex), consulted before the filesystem
+        self.index = None
+        # Shared store (a ChiveStore) behind the local checkpoint directory, if any
+        self.remote = None
+        self._remote_manifests: Dict[str, Optional[dict]] = {}
+        self._fetches: Dict[str, Future] = {}
+        self._remote_lock = threading.Lock()
+
+    @property
+    def formats(self) -> List[ChiveFormat]:
+        return FORMATS
+
+    def find(self, save_name: str | Path) -> Optional[Tuple[ChiveFormat, Path]]:
+        """Locate the file for a checkpoint saved under save_name in any format."""
+        if self.index is not None:
+            entry = self.index.get(save_name)
+            if entry is not None:
+                path = Path(f"{save_name}{entry.format}")
+                formats = [f for f in self.formats if f.extension == entry.format]
+                fmt = formats[0] if formats else None
+                if fmt is not None and path.exists():
+                    return fmt, path
+                # Deleted behind the index's back
+                self.index.remove(save_name)
+        for fmt in self.formats:
+            path = Path(f"{save_name}{fmt.extension}")
+            if path.exists():
+                return fmt, path
+        return None
+
+    def exists(self, save_name: str | Path) -> bool:
+        return self.find(save_name) is not None
+
+    def find_current(
+        self,
+        save_name: str | Path,
+        code: Optional[str],
+        replicates: Optional[int] = None,
+    ) -> Optional[Tuple[ChiveFormat, Path]]:
+        """
+        Like find, but ignores a checkpoint whose manifest records a different code
+        fingerprint, i.e. one computed by code that has since been edited. Checkpoints
+        without a recorded fingerprint are trusted. With replicates, also ignores a
+        checkpoint that isn't a set of that many replicates.
+
+        With a remote store, a checkpoint only found there is returned with the local
+        path it will be downloaded to when loaded.
+        """
+        found = self._find_current_local(save_name, code)
+        if found is not None and replicates is not None:
+            manifest = self.read_manifest(Path(save_name).parent) or {}
+            if manifest.get("replicates") != replicates:
+                return None
+        if found is not None or self.remote is None:
+            return found
+        manifest = self.remote_manifest(save_name)
+        if not manifest or code is not None and manifest.get("code", code) != code:
+            return None
+        formats = [f for f in self.formats if f.extension == manifest.get("format")]
+        if not formats or isinstance(formats[0], ChunksFormat):
+            return None
+        return formats[0], Path(f"{save_name}{formats[0].extension}")
+
+    def _find_current_local(
+        self, save_name: str | Path, code: Optional[str]
+    ) -> Optional[Tuple[ChiveFormat, Path]]:
+        found = self.find(save_name)
+        if found is None or code is None:
+            return found
+        entry = self.index.get(save_name) if self.index is not None else None
+        if entry is not None:
+            manifest = {"code": entry.code} if entry.code is not None else {}
+        else:
+            manifest = self.read_manifest(Path(save_name).parent) or {}
+        if manifest.get("code", code) != code:
+            return None
+        return found
+
+    def save(
+        self,
+        obj,
+        save_name: str | Path,
+        manifest: Optional[dict] = None,
+        compress: Optional[str] = None,
+    ):
+        if compress:
+            # Fail loudly on a bad codec rather than falling through to another format
+            get_codec(compress)
+        with self._observe("save", save_name) as info:
+            fmt, path = self._write(obj, save_name, compress)
+            info["bytes"] = size = path.stat().st_size
+        self._commit(save_name, fmt, path, size, manifest, compress)
+        return path
+
+    def adopt(
+        self,
+        save_name: str | Path,
+        manifest: Optional[dict] = None,
+        compress: Optional[str] = None,
+    ) -> Path:
+        """
+        Take on a checkpoint another process wrote to save_name without a manifest:
+        write its manifest, index it and share it as if it had been saved here.
+        """
+        found = self.find(save_name)
+        if found is None:
+            raise FileNotFoundError(f"No checkpoint found at {save_name}")
+        fmt, path = found
+        self._commit(save_name, fmt, path, _disk_size(path), manifest, compress)
+        return path
 
-    def save(self, obj, save_name: str | Path):
-        save_name = str(save_name)
+    def _commit(
+        self,
+        save_name: str | Path,
+        fmt: ChiveFormat,
+        path: Path,
+        size: int,
+        manifest: Optional[dict],
+        compress: Optional[str],
+    ):
+        self.clear_failure(save_name)
+        if manifest is not None:
+            if not isinstance(fmt, StreamFormat):
+                compress = None
+            manifest = {**manifest, "format": fmt.extension, "compression": compress}
+            manifest_path = self.write_manifest(Path(save_name).parent, manifest)
+        if self.index is not None:
+            record = {**(manifest or {}), "format": fmt.extension}
+            self.index.record(save_name, record, size)
+        key = self._remote_key(save_name)
+        if key is not None and manifest is not None:
+            # The manifest goes last, so it never announces data that isn't there yet.
+            # Sharing is best-effort: the local checkpoint is committed either way.
+            manifest_key = f"{posixpath.dirname(key)}/{MANIFEST_NAME}"
+            if self.remote.try_put(
+                f"{key}{fmt.extension}", path
+            ) and self.remote.try_put(manifest_key, manifest_path):
+                with self._remote_lock:
+                    self._remote_manifests[str(save_name)] = manifest
+
+    def _write(
+        self,
+        obj,
+        save_name: str | Path,
+        compress: Optional[str],
+        formats: Optional[Sequence[ChiveFormat]] = None,
+    ) -> Tuple[ChiveFormat, Path]:
         Path(save_name).parent.mkdir(parents=True, exist_ok=True)
-        # Try to pickle the object
-        try:
-            with open(save_name, "wb") as f:
-                pickle.dump(obj, f)
-        except Exception as e:
+        error = None
+        for fmt in self.formats if formats is None else formats:
+            if not fmt.match(obj):
+                continue
+            # Write next to the destination and rename into place, so a crash or a
+            # concurrent reader never sees a partially written checkpoint
+            tmp_path = _tmp_path(f"{save_name}{fmt.extension}")
+            try:
+                if compress and isinstance(fmt, StreamFormat):
+                    fmt.save(obj, tmp_path, compress=compress)
+                else:
+                    fmt.save(obj, tmp_path)
+            except Exception as e:
+                # Fall through to the next matching format, ending at pickle
+                tmp_path.unlink(missing_ok=True)
+                error = e
+                continue
+            # Make the contents durable before the rename commits them
+            _fsync(tmp_path)
+            os.replace(tmp_path, f"{save_name}{fmt.extension}")
+            break
+        else:
             raise NotImplementedError(
                 f"Unable to save {repr(obj)!r} of type {type(obj)}."
-            ) from e
+            ) from error
+        self._remove_other_formats(save_name, fmt)
+        return fmt, Path(f"{save_name}{fmt.extension}")
+
+    def _remove_other_formats(self, save_name: str | Path, fmt: ChiveFormat):
+        # Remove any copy left behind in a different format so it can't shadow this one
+        for other in self.formats:
+            if other.extension != fmt.extension:
+                _remove(Path(f"{save_name}{other.extension}"))
+
+    def save_stream(
+        self,
+        chunks: Iterable,
+        save_name: str | Path,
+        manifest: Optional[dict] = None,
+        compress: Optional[str] = None,
+    ) -> ChiveStream:
+        """
+        Save a streaming checkpoint one chunk at a time as they are produced. Chunks go
+        to {save_name}.chunks.partial, which becomes {save_name}.chunks once chunks is
+        exhausted; a stream interrupted before then resumes after the chunks it saved,
+        provided it was computed by the same code.
+        """
+        if compress:
+            get_codec(compress)
+        partial = self._begin_partial(save_name, ChunksFormat(), manifest)
+        done = len(_chunk_files(partial))
+        start = time.perf_counter()
+        with self._observe("save", save_name) as info, _resuming(done) as resume:
+            index = None
+            for chunk in chunks:
+                if index is None:
+                    # A generator that asked where to resume starts after the saved
+                    # chunks; any other starts over, and those chunks are skipped
+                    index = done if resume["acknowledged"] else 0
+                if index >= done:
+                    self._write(chunk, partial / f"{index:06d}", compress)
+                index += 1
+            count = done if index is None else index
+            for stale in _chunk_files(partial)[count:]:
+                stale.unlink()
+            info["bytes"] = _disk_size(partial)
+        manifest = {
+            **(manifest or {}),
+            "compression": compress or None,
+            "chunks": count,
+            "compute_time": time.perf_counter() - start,
+        }
+        return self._commit_partial(partial, save_name, ChunksFormat(), manifest)
+
+    def save_replicates(
+        self,
+        replicates: Callable[[List[int]], Iterable[Tuple[int, Any]]],
+        count: int,
+        save_name: str | Path,
+        manifest: Optional[dict] = None,
+        compress: Optional[str] = None,
+    ) -> list:
+        """
+        Save count replicates of a checkpoint, each as soon as it is computed.
+        replicates is called with the indices still missing and yields (index, value)
+        pairs in any order. Replicates saved by an interrupted run of the same code are
+        kept, so only the rest are computed again.
+        """
+        if compress:
+            get_codec(compress)
+        final = Path(f"{save_name}{ReplicatesFormat.extension}")
+        partial = Path(f"{final}.partial")
+        if final.is_dir() and not partial.exists():
+            # Start from a set saved with a different count, which _begin_partial
+            # discards unless it was computed by the same code
+            code = (self.read_manifest(final.parent) or {}).get("code")
+            os.replace(final, partial)
+            (partial / ".code").write_text(str(code))
+        partial = self._begin_partial(save_name, ReplicatesFormat(), manifest)
+        done = set()
+        for file in _chunk_files(partial):
+            index = int(file.name.split(".")[0])
+            if index < count:
+                done.add(index)
+            else:
+                _remove(file)
+        missing = [i for i in range(count) if i not in done]
+        start = time.perf_counter()
+        with self._observe("save", save_name) as info:
+            for index, value in replicates(missing):
+                self._write(value, partial / f"{index:06d}", compress)
+            info["bytes"] = _disk_size(partial)
+        manifest = {
+            **(manifest or {}),
+            "compression": compress or None,
+            "replicates": count,
+            "compute_time": time.perf_counter() - start,
+        }
+        return self._commit_partial(partial, save_name, ReplicatesFormat(), manifest)
+
+    def _begin_partial(
+        self, save_name: str | Path, fmt: ChunksFormat, manifest: Optional[dict]
+    ) -> Path:
+        """
+        Directory a checkpoint saved in pieces is written to until it is complete,
+        keeping any pieces an interrupted save by the same code left there.
+        """
+        partial = Path(f"{save_name}{fmt.extension}.partial")
+        code = str((manifest or {}).get("code"))
+        code_path = partial / ".code"
+        if partial.exists() and (
+            not code_path.exists() or code_path.read_text() != code
+        ):
+            _remove(partial)
+        partial.mkdir(parents=True, exist_ok=True)
+        code_path.write_text(code)
+        return partial
+
+    def _commit_partial(
+        self, partial: Path, save_name: str | Path, fmt: ChunksFormat, manifest: dict
+    ):
+        final = Path(f"{save_name}{fmt.extension}")
+        (partial / ".code").unlink()
+        _remove(final)
+        os.replace(partial, final)
+        self._remove_other_formats(save_name, fmt)
+        self.clear_failure(save_name)
+        manifest = {**manifest, "format": fmt.extension}
+        self.write_manifest(final.parent, manifest)
+        if self.index is not None:
+            self.index.record(save_name, manifest, _disk_size(final))
+        return fmt.load(final)
 
     def load(self, save_name: str | Path):
-        save_name = str(save_name)
-        with open(save_name, "rb") as f:
-            return pickle.load(f)
+        found = self.find(save_name)
+        if found is None and self.remote is not None:
+            found = self.fetch(save_name)
+        if found is None:
+            raise FileNotFoundError(f"No checkpoint found at {save_name}")
+        fmt, path = found
+        if self.index is not None:
+            self.index.touch(save_name)
+        with self._observe("load", save_name) as info:
+            info["bytes"] = _disk_size(path)
+            return fmt.load(path)
 
+    def _observe(self, op: str, save_name: str | Path) -> ContextManager[dict]:
+        if self.observer is None:
+            return contextlib.nullcontext({})
+        return self.observer(op, str(save_name))
 
-def get_save_path(
+    def write_manifest(self, save_path: str | Path, manifest: dict) -> Path:
+        path = Path(save_path) / MANIFEST_NAME
+        tmp_path = _tmp_path(path)
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+        return path
+
+    def read_manifest(self, save_path: str | Path) -> Optional[dict]:
+        try:
+            with open(Path(save_path) / MANIFEST_NAME) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # Failure records
+
+    def record_failure(
+        self, save_name: str | Path, error: BaseException, code: Optional[str]
+    ):
+        """
+        Remember that computing the checkpoint at save_name raised error, so that later
+        sessions can report it instead of computing it again with the same code.
+        """
+        record = {
+            "error": type(error).__qualname__,
+            "message": str(error),
+            "traceback": "".join(
+                traceback.format_exception(type(error), error, error.__traceback__)
+            ),
+            "code": code,
+            "time": time.time(),
+        }
+        path = Path(f"{save_name}{FAILURE_SUFFIX}")
+        # The record is only an optimization; never fail over it
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = _tmp_path(path)
+            with open(tmp_path, "w") as f:
+                json.dump(record, f, indent=2)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def find_failure(
+        self, save_name: str | Path, code: Optional[str]
+    ) -> Optional[dict]:
+        """The failure recorded for save_name, unless its code has changed since."""
+        try:
+            with open(f"{save_name}{FAILURE_SUFFIX}") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record.get("code") != code:
+            return None
+        return record
+
+    def clear_failure(self, save_name: str | Path):
+        Path(f"{save_name}{FAILURE_SUFFIX}").unlink(missing_ok=True)
+
+    # Remote store
+
+    def _remote_key(self, save_name: str | Path) -> Optional[str]:
+        """Key of a checkpoint in the remote store, if it is in the checkpoint dir."""
+        if self.remote is None:
+            return None
+        rel = os.path.relpath(save_name, CHIVE_DIR)
+        if rel.startswith(os.pardir) or os.path.isabs(rel):
+            return None
+        return Path(rel).as_posix()
+
+    def _download(self, key: str, path: Path) -> bool:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = _tmp_path(path)
+        try:
+            if not self.remote.try_get(key, tmp_path):
+                return False
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return True
+
+    def remote_manifest(self, save_name: str | Path) -> Optional[dict]:
+        """Manifest of a checkpoint in the remote store, fetched once per session."""
+        key = self._remote_key(save_name)
+        if key is None:
+            return None
+        with self._remote_lock:
+            if str(save_name) in self._remote_manifests:
+                return self._remote_manifests[str(save_name)]
+        path = _tmp_path(Path(save_name).parent / MANIFEST_NAME)
+        manifest = None
+        try:
+            if self._download(f"{posixpath.dirname(key)}/{MANIFEST_NAME}", path):
+                with open(path) as f:
+                    manifest = json.load(f)
+        except ValueError:
+            pass
+        finally:
+            path.unlink(missing_ok=True)
+        with self._remote_lock:
+            self._remote_manifests[str(save_name)] = manifest
+        return manifest
+
+    def fetch(self, save_name: str | Path) -> Optional[Tuple[ChiveFormat, Path]]:
+        """
+        Download a checkpoint from the remote store into the local directory, or wait
+        for a prefetch of it to finish. Returns what find would afterwards.
+        """
+        with self._remote_lock:
+            future = self._fetches.get(str(save_name))
+        if future is not None:
+            return future.result()
+        return self._fetch(save_name)
+
+    def _fetch(self, save_name: str | Path) -> Optional[Tuple[ChiveFormat, Path]]:
+        manifest = self.remote_manifest(save_name)
+        extension = (manifest or {}).get("format")
+        formats = [f for f in self.formats if f.extension == extension]
+        if not formats or isinstance(formats[0], ChunksFormat):
+            # Checkpoints saved in pieces (streams, replicates) are not shared
+            return None
+        fmt = formats[0]
+        path = Path(f"{save_name}{fmt.extension}")
+        with self._observe("fetch", save_name) as info:
+            key = f"{self._remote_key(save_name)}{fmt.extension}"
+            if not self._download(key, path):
+                return None
+            info["bytes"] = size = path.stat().st_size
+        self.write_manifest(path.parent, manifest)
+        if self.index is not None:
+            self.index.record(save_name, manifest, size)
+        return fmt, path
+
+    def prefetch(self, save_names: Iterable[str | Path], workers: int = 8):
+        """Start downloading checkpoints missing locally, workers at a time."""
+        if self.remote is None:
+            return
+        missing = [name for name in dict.fromkeys(save_names) if self.find(name) is None]
+        if not missing:
+            return
+        executor = ThreadPoolExecutor(workers, thread_name_prefix="chive-prefetch")
+        with self._remote_lock:
+            for save_name in missing:
+                if str(save_name) not in self._fetches:
+                    future = executor.submit(self._fetch, save_name)
+                    self._fetches[str(save_name)] = future
+        # The downloads still run to completion
+        executor.shutdown(wait=False)
+
+def _chunk_files(path: str | Path) -> List[Path]:
+    """The chunks of a streaming checkpoint, in order."""
+    return sorted(p for p in Path(path).iterdir() if not p.name.startswith("."))
+
+
+def _disk_size(path: Path) -> int:
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size
+
+
+def _remove(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def _canonicalize(value) -> str:
+    """
+    Produce a stable string encoding of a parameter value for hashing. Containers are
+    encoded recursively with mappings and sets sorted, array-likes and pandas objects
+    are reduced to their type, shape and a digest of their contents, and functions and
+    classes to their import path. Other objects are encoded by their repr, which must
+    then be their own: the default one, with a memory address, changes every session.
+    """
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        return f"{type(value).__name__}:{value!r}"
+    if isinstance(value, Path):
+        return f"path:{value.as_posix()!r}"
+    if isinstance(value, (list, tuple)):
+        items = ",".join(_canonicalize(v) for v in value)
+        return f"{type(value).__name__}:[{items}]"
+    if isinstance(value, (set, frozenset)):
+        items = ",".join(sorted(_canonicalize(v) for v in value))
+        return f"set:{{{items}}}"
+    if isinstance(value, Mapping):
+        items = ",".join(
+            sorted(f"{_canonicalize(k)}={_canonicalize(v)}" for k, v in value.items())
+        )
+        return f"dict:{{{items}}}"
+    pd = sys.modules.get("pandas")
+    if pd is not None and isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        # Reprs of large pandas objects are truncated, so hash the values themselves
+        rows = pd.util.hash_pandas_object(value, index=not isinstance(value, pd.Index))
+        digest = hashlib.sha256(rows.to_numpy().tobytes()).hexdigest()
+        if isinstance(value, pd.DataFrame):
+            meta = _canonicalize({str(k): str(v) for k, v in value.dtypes.items()})
+            meta += _canonicalize([str(c) for c in value.columns])
+        else:
+            meta = f"{value.dtype!s}:{_canonicalize(value.name)}"
+        return f"{type(value).__qualname__}:{meta}:{value.shape!r}:{digest}"
+    if hasattr(value, "dtype") and hasattr(value, "shape") and hasattr(value, "tobytes"):
+        if getattr(value.dtype, "hasobject", False):
+            # The raw bytes of object arrays are pointers
+            items = _canonicalize(value.tolist())
+            return f"array:object:{tuple(value.shape)!r}:{items}"
+        digest = hashlib.sha256(value.tobytes()).hexdigest()
+        return f"array:{value.dtype!s}:{tuple(value.shape)!r}:{digest}"
+    if inspect.isfunction(value) or inspect.isclass(value) or inspect.isbuiltin(value):
+        return f"ref:{value.__module__}.{value.__qualname__}"
+    if type(value).__repr__ is object.__repr__:
+        raise TypeError(
+            f"Parameter value {value!r} has no stable encoding for checkpoint keys; "
+            f"give {type(value).__qualname__} a __repr__ that describes its contents"
+        )
+    return f"{type(value).__qualname__}:{value!r}"
+
+
+# Per-checkpoint parameter overrides, from the checkpoints: section of the config, as
+# {checkpoint: {"ignore": [param, ...], "pin": {param: value}}}
+_overrides: Dict[str, Dict[str, Any]] = {}
+
+
+def set_checkpoint_overrides(overrides: Optional[Mapping[str, Dict[str, Any]]]):
+    global _overrides
+    _overrides = dict(overrides or {})
+
+
+def apply_checkpoint_overrides(name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The parameters identifying an instance of checkpoint name, with those it ignores
+    dropped and those it pins set to their pinned values. Instances that then have
+    the same parameters are one and the same.
+    """
+    override = _overrides.get(name)
+    if not override:
+        return params
+    pin = override.get("pin", {})
+    ignore = override.get("ignore", ())
+    return {k: pin.get(k, v) for k, v in params.items() if k not in ignore}
+
+
+def checkpoint_key(name: str, params: Mapping[str, Any]) -> str:
+    """
+    Content-addressed key for a node: a digest of the node name and the canonicalized
+    values of the parameters it depends on. Parameter order does not matter.
+    """
+    h = hashlib.sha256(name.encode())
+    for k in sorted(params):
+        h.update(f"\0{k}\0{_canonicalize(params[k])}".encode())
+    return h.hexdigest()[:16]
+
+
+def _get_dependencies(
+    argnames: Iterable[str], get_fixturedef: Callable[[str], Any]
+) -> Set[str]:
+    """
+    All fixture names reachable from argnames, i.e. everything a node depends on.
+    Parameters that a checkpoint on the way ignores or pins aren't reached through it,
+    since they don't change its value.
+    """
+    dependencies = set()
+    seen = set()
+    stack = [(argname, frozenset()) for argname in argnames]
+    while stack:
+        argname, hidden = stack.pop()
+        if argname == "request" or argname in hidden or (argname, hidden) in seen:
+            continue
+        seen.add((argname, hidden))
+        dependencies.add(argname)
+        fixturedef = get_fixturedef(argname)
+        if fixturedef is not None:
+            override = _overrides.get(argname)
+            if override:
+                hidden = hidden.union(
+                    override.get("ignore", ()), override.get("pin", {})
+                )
+            stack.extend((name, hidden) for name in fixturedef.argnames)
+    return dependencies
+
+
+@functools.lru_cache(maxsize=None)
+def _function_fingerprint(func: Callable) -> str:
+    """
+    Digest of a function's own code. Tokens are hashed from the def onwards, so
+    decorators, comments, blank lines and line continuations do not change it.
+    """
+    try:
+        source = textwrap.dedent(inspect.getsource(func))
+    except (OSError, TypeError):
+        code = getattr(func, "__code__", None)
+        data = code.co_code if code is not None else repr(func).encode()
+        return hashlib.sha256(data).hexdigest()[:16]
+    h = hashlib.sha256()
+    started = False
+    for tok in tokenize.generate_tokens(iter(source.splitlines(keepends=True)).__next__):
+        if not started:
+            if tok.type != tokenize.NAME or tok.string != "def":
+                continue
+            started = True
+        if tok.type in (tokenize.COMMENT, tokenize.NL):
+            continue
+        text = tokenize.tok_name[tok.type] if tok.type in (
+            tokenize.INDENT, tokenize.DEDENT, tokenize.NEWLINE
+        ) else tok.string
+        h.update(f"{text}\0".encode())
+    return h.hexdigest()[:16]
+
+
+def get_code_fingerprint(
+    fixturedef,
+    get_fixturedef: Callable[[str], Any],
+    params: Collection[str] = (),
+) -> str:
+    """
+    Digest of the code a node's value depends on: its own function and those of every
+    fixture upstream of it. Parameters are left out, their values are part of the key.
+    """
+    h = hashlib.sha256()
+    names = _get_dependencies(fixturedef.argnames, get_fixturedef) - set(params)
+    for name, dep in [
+        (fixturedef.argname, fixturedef),
+        *((name, get_fixturedef(name)) for name in sorted(names)),
+    ]:
+        if dep is None:
+            continue
+        # During setup the func may have been swapped for one of ChivePlugin's wrappers
+        func = inspect.unwrap(getattr(dep, "_chive_old_func", dep.func))
+        h.update(f"\0{name}\0{_function_fingerprint(func)}".encode())
+    return h.hexdigest()[:16]
+
+
+def get_save_params(
     request,
     filter_dependencies: bool = True,
-):
+) -> Dict[str, Any]:
     if filter_dependencies and hasattr(request, "_fixturedef"):
         # If this is for a checkpoint, not an output, we only want to save it based on
         # the values of parameters/nodes it actually depends on
-        dependencies = set()
-        fixturedef = request._fixturedef
-
-        def add_dependencies(argnames):
-            for argname in argnames:
-                if argname == "request":
-                    continue
-                dependencies.add(argname)
-                add_dependencies(request._fixture_defs[argname].argnames)
-
-        add_dependencies(fixturedef.argnames)
+        dependencies = _get_dependencies(
+            request._fixturedef.argnames, request._fixture_defs.get
+        )
     else:
         dependencies = None
-    request_params = {k: v for k, v in request._pyfuncitem.callspec.params.items()}
-    params = defaultdict(lambda: "")
     try:
-        params.update(
-            {
-                k: f"{k}={str(v)}"
-                for k, v in request_params.items()
-                if (dependencies is None or k in dependencies)
-            }
-        )
+        request_params = request._pyfuncitem.callspec.params
+    except AttributeError:
+        return {}
+    params = {
+        k: v
+        for k, v in sorted(request_params.items())
+        if (dependencies is None or k in dependencies)
+    }
+    if dependencies is not None:
+        params = apply_checkpoint_overrides(request.fixturename, params)
+    return params
+
+
+def get_item_node_params(
+    item, attr: str = "_chive_node"
+) -> Dict[str, Dict[str, Any]]:
+    """
+    For each lazy node (or, with attr="_chive_checkpoint", each checkpoint) in a collected
+    item's fixture closure, the parameters that identify its instance. Mirrors
+    get_save_params, but works before setup.
+    """
+    info = getattr(item, "_fixtureinfo", None)
+    if info is None:
+        return {}
+    try:
+        item_params = item.callspec.params
     except AttributeError:
-        pass
+        item_params = {}
+
+    def get_fixturedef(name):
+        fixturedefs = info.name2fixturedefs.get(name)
+        return fixturedefs[-1] if fixturedefs else None
+
+    nodes = {}
+    for name in info.names_closure:
+        fixturedef = get_fixturedef(name)
+        if fixturedef is None or not hasattr(fixturedef.func, attr):
+            continue
+        dependencies = _get_dependencies(fixturedef.argnames, get_fixturedef)
+        nodes[name] = apply_checkpoint_overrides(
+            name, {k: v for k, v in sorted(item_params.items()) if k in dependencies}
+        )
+    return nodes
+
+
+def get_item_checkpoint_params(item) -> Dict[str, Dict[str, Any]]:
+    return get_item_node_params(item, attr="_chive_checkpoint")
+
+
+def get_save_manifest(name: str, params: Mapping[str, Any]) -> dict:
+    """Human-readable record of what a checkpoint key was computed from."""
 
-    save_path = ".chive/" + "/".join(params.values())
-    return save_path
+    def _readable(v):
+        s = str(v)
+        return s if len(s) <= 200 else s[:197] + "..."
+
+    return {
+        "key": checkpoint_key(name, params),
+        "node": name,
+        "params": {k: _readable(v) for k, v in sorted(params.items())},
+    }
+
+
+def get_checkpoint_dir(name: str, params: Mapping[str, Any]) -> str:
+    return f"{CHIVE_DIR}/{name}/{checkpoint_key(name, params)}"
+
+
+def get_save_path(
+    request,
+    filter_dependencies: bool = True,
+):
+    name = getattr(request, "fixturename", None) or request.node.name
+    params = get_save_params(request, filter_dependencies=filter_dependencies)
+    return get_checkpoint_dir(name, params)
@@ -1,39 +1,107 @@
+from concurrent.futures import Executor, Future, wait, FIRST_COMPLETED
+import functools
+import importlib
 import inspect
-from typing import Callable, Any
+import sys
+import threading
+import time
+from typing import Callable, Any, ContextManager, Dict, List, Optional
 
+from .stream import ChiveStream
 from .utils import ChiveInternalError
 
 
+# Value of cache_val until a node has been computed, since None is a valid result
+_MISSING: Any = object()
+
+# Executor used to resolve independent upstream nodes concurrently, if any
+_executor: Optional[Executor] = None
+# Called with each node about to be computed; returns a context manager around it
+_profiler: Optional[Callable[["ChiveLazyFunc"], ContextManager]] = None
+# Set on threads running a node for _resolve_concurrently, which resolve the inputs it
+# couldn't see (e.g. behind a lease) themselves rather than wait on their own pool
+_on_worker = threading.local()
+
+
+def set_executor(executor: Optional[Executor]):
+    global _executor
+    _executor = executor
+
+
+def set_profiler(profiler: Optional[Callable[["ChiveLazyFunc"], ContextManager]]):
+    global _profiler
+    _profiler = profiler
+
+
 class ChiveLazyFunc:
     def __init__(self, func, *args, **kwargs):
-        if inspect.isgeneratorfunction(func):
-            raise ValueError("ChiveLazyFunc cannot be used with generator functions")
         self.func = func
         self.args = args
         self.kwargs = kwargs
-        self.cache_val = None
+        # Node name and instance key, for reporting. Internal helpers have no name.
+        self.name: Optional[str] = getattr(func, "__name__", None)
+        self.key: Optional[str] = None
+        # Seconds the last computation of func took, excluding resolving its inputs
+        self.compute_time: Optional[float] = None
+        self.cache_val = _MISSING
         self.cache_error = None
 
         self.save_callback = None
+        # Called with any exception func itself raises, not ones from its inputs
+        self.error_callback: Optional[Callable[[Exception], None]] = None
+        # Function that produces the value again from storage, if it has been stored
+        self.reload: Optional[Callable[[], Any]] = None
+        self._lock = threading.Lock()
 
     def set_save_callback(self, save_callback: Callable[[Any], None]):
         self.save_callback = save_callback
 
     def __call__(self):
-        if self.cache_val is not None:
+        if self.cache_val is not _MISSING:
             # print("Returning cached value")
             return self.cache_val
         if self.cache_error is not None:
             raise self.cache_error
-        try:
-            self.cache_val = self.func(
-                *[_resolve(arg) for arg in self.args],
-                **{k: _resolve(v) for k, v in self.kwargs.items()},
-            )
-        except Exception as e:
-            self.cache_error = e
-            raise
-            
+        if (
+            _executor is not None
+            and not getattr(_on_worker, "active", False)
+            and self._pending_deps()
+        ):
+            _resolve_concurrently(self, _executor)
+        with self._lock:
+            if self.cache_val is not _MISSING:
+                return self.cache_val
+            if self.cache_error is not None:
+                raise self.cache_error
+            try:
+                args = [_resolve(arg) for arg in self.args]
+                kwargs = {k: _resolve(v) for k, v in self.kwargs.items()}
+            except Exception as e:
+                self.cache_error = e
+                raise
+            try:
+                start = time.perf_counter()
+                if self.streaming:
+                    # Chunks are generated afresh each time the stream is iterated
+                    val = ChiveStream(functools.partial(self.func, *args, **kwargs))
+                elif _profiler is not None and self.name is not None:
+                    with _profiler(self):
+                        val = self.func(*args, **kwargs)
+                else:
+                    val = self.func(*args, **kwargs)
+                self.compute_time = time.perf_counter() - start
+            except Exception as e:
+                self._set_error(e)
+                raise
+            return self._set_result(val)
+
+    @property
+    def streaming(self) -> bool:
+        """Whether func is a generator, whose value is the stream of its chunks."""
+        return inspect.isgeneratorfunction(self.func)
+
+    def _set_result(self, val):
+        self.cache_val = val
         if self.save_callback is not None:
             try:
                 self.save_callback(self.cache_val)
@@ -45,8 +113,145 @@ class ChiveLazyFunc:
 
         return self.cache_val
 
+    def _set_error(self, error: Exception):
+        self.cache_error = error
+        if self.error_callback is not None:
+            self.error_callback(error)
+
+    @property
+    def cached(self) -> bool:
+        """Whether the value has been computed (or loaded) and is held in memory."""
+        return self.cache_val is not _MISSING
+
+    def evict(self):
+        """
+        Drop the cached value to free memory. If the value can be reloaded, the node
+        switches to reloading it rather than recomputing it from its inputs.
+        """
+        with self._lock:
+            if self.cache_val is _MISSING:
+                return
+            if self.reload is not None:
+                self.func, self.args, self.kwargs = self.reload, (), {}
+                self.save_callback = None
+            self.cache_val = _MISSING
+
+    def _done(self) -> bool:
+        return self.cache_val is not _MISSING or self.cache_error is not None
+
+    def _pending_deps(self) -> List["ChiveLazyFunc"]:
+        return [
+            arg
+            for arg in [*self.args, *self.kwargs.values()]
+            if isinstance(arg, ChiveLazyFunc) and not arg._done()
+        ]
+
 
 def _resolve(arg):
     if isinstance(arg, ChiveLazyFunc):
         return arg()
     return arg
+
+
+def _call_on_worker(node: ChiveLazyFunc):
+    _on_worker.active = True
+    try:
+        return node()
+    finally:
+        _on_worker.active = False
+
+
+def _call_by_reference(module: str, qualname: str, args, kwargs):
+    # Node functions are shadowed in their module by the pytest fixture wrapping them,
+    # so they can't be pickled directly; look them up and unwrap them in the worker.
+    obj: Any = importlib.import_module(module)
+    for part in qualname.split("."):
+        obj = getattr(obj, part)
+    return inspect.unwrap(obj)(*args, **kwargs)
+
+
+def _resolve_concurrently(root: ChiveLazyFunc, executor: Executor):
+    """
+    Compute every unresolved node strictly upstream of root, running each one as soon as
+    all of its own dependencies are available. Nodes are only ever submitted once their
+    inputs are cached, and inputs hidden from the scheduler (a checkpoint's behind the
+    lease that coordinates it with other processes) are resolved serially by the worker
+    that needs them, so workers never block on each other.
+    """
+    deps: Dict[ChiveLazyFunc, List[ChiveLazyFunc]] = {}
+    stack = root._pending_deps()
+    while stack:
+        node = stack.pop()
+        if node in deps:
+            continue
+        deps[node] = node._pending_deps()
+        stack.extend(deps[node])
+
+    waiting_on = {node: len(set(d)) for node, d in deps.items()}
+    dependents: Dict[ChiveLazyFunc, List[ChiveLazyFunc]] = {node: [] for node in deps}
+    for node, d in deps.items():
+        for dep in set(d):
+            dependents[dep].append(node)
+
+    # A process pool has necessarily been imported already if that is what this is
+    process_pool = sys.modules.get("concurrent.futures.process")
+    processes = process_pool is not None and isinstance(
+        executor, process_pool.ProcessPoolExecutor
+    )
+    running: Dict[Future, ChiveLazyFunc] = {}
+
+    def submit(node: ChiveLazyFunc) -> bool:
+        if node._done():
+            return False
+        if not processes:
+            running[executor.submit(_call_on_worker, node)] = node
+            return True
+        if "<locals>" in node.func.__qualname__ or node.streaming:
+            # Not importable in a worker (e.g. a checkpoint load), or a stream whose
+            # chunks are produced lazily where they are consumed, so run it here
+            try:
+                node()
+            except Exception:
+                pass
+            return False
+        try:
+            args = [_resolve(arg) for arg in node.args]
+            kwargs = {k: _resolve(v) for k, v in node.kwargs.items()}
+        except Exception as e:
+            node.cache_error = e
+            return False
+        future = executor.submit(
+            _call_by_reference, node.func.__module__, node.func.__qualname__, args, kwargs
+        )
+        running[future] = node
+        return True
+
+    def finish(node: ChiveLazyFunc):
+        for dependent in dependents[node]:
+            waiting_on[dependent] -= 1
+            if waiting_on[dependent] == 0:
+                ready.append(dependent)
+
+    ready = [node for node, count in waiting_on.items() if count == 0]
+    while ready or running:
+        while ready:
+            node = ready.pop()
+            if not submit(node):
+                finish(node)
+        if not running:
+            continue
+        done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+        for future in done:
+            node = running.pop(future)
+            error = future.exception()
+            if processes:
+                with node._lock:
+                    if error is not None:
+                        node._set_error(error)
+                    elif not node._done():
+                        try:
+                            node._set_result(future.result())
+                        except Exception:
+                            pass
+            # Errors are cached on the node and re-raised to whoever resolves it
+            finish(node)
@@ -0,0 +1,149 @@
+import json
+import os
+from pathlib import Path
+import socket
+import threading
+import time
+from typing import *
+
+
+class ChiveLease:
+    """
+    Exclusive lease on a checkpoint key, held as a lock file created next to it.
+
+    The holder refreshes the file's mtime while it holds the lease. A lease whose file
+    has not been refreshed for ttl seconds, or whose owner is a dead process on this
+    host, is stale and may be broken by anyone.
+    """
+
+    def __init__(self, save_name: str | Path, ttl: float = 60.0):
+        self.path = Path(f"{save_name}.lock")
+        self.ttl = ttl
+        self.owner = {"host": socket.gethostname(), "pid": os.getpid()}
+
+    def try_acquire(self) -> bool:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            json.dump({**self.owner, "time": time.time()}, f)
+        return True
+
+    def refresh(self):
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            pass
+
+    def release(self):
+        self.path.unlink(missing_ok=True)
+
+    def is_stale(self) -> bool:
+        return self._is_stale(self.path)
+
+    def _is_stale(self, path: Path) -> bool:
+        try:
+            mtime = path.stat().st_mtime
+            with open(path) as f:
+                owner = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError):
+            # Unreadable or half-written; only trust the age
+            owner = {}
+        if time.time() - mtime > self.ttl:
+            return True
+        if owner.get("host") == self.owner["host"] and isinstance(owner.get("pid"), int):
+            try:
+                os.kill(owner["pid"], 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return False
+
+    def break_stale(self):
+        # Move the lock aside and check it again before deleting it: if another process
+        # broke the stale lock first, what was moved may be a fresh lease taken since,
+        # which is put back
+        aside = self.path.with_name(f"{self.path.name}.{os.getpid()}.stale")
+        try:
+            os.rename(self.path, aside)
+        except FileNotFoundError:
+            return
+        if not self._is_stale(aside):
+            try:
+                # Unlike a rename, never replaces a lease taken in the meantime
+                os.link(aside, self.path)
+            except FileExistsError:
+                pass
+        aside.unlink(missing_ok=True)
+
+
+class ChiveLocks:
+    """
+    Coordinates computation of checkpoints between processes sharing a .chive directory,
+    e.g. pytest-xdist workers. One process computes a key while the others wait for its
+    result to be committed, and held leases are kept fresh by a heartbeat thread.
+    """
+
+    def __init__(self, ttl: float = 60.0, poll_interval: float = 0.2):
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.held: Set[ChiveLease] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(
+            target=self._refresh_loop, name="chive-lease-heartbeat", daemon=True
+        )
+        self._heartbeat.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.ttl / 4):
+            with self._lock:
+                held = list(self.held)
+            for lease in held:
+                lease.refresh()
+
+    def acquire(
+        self, save_name: str | Path, ready: Callable[[], bool]
+    ) -> Optional[ChiveLease]:
+        """
+        Wait until either ready() is true, in which case None is returned and the caller
+        should load the committed checkpoint, or this process holds the lease for
+        save_name and should compute it.
+        """
+        lease = ChiveLease(save_name, ttl=self.ttl)
+        delay = self.poll_interval
+        while True:
+            if ready():
+                return None
+            if lease.try_acquire():
+                # The previous holder may have committed just before releasing
+                if ready():
+                    lease.release()
+                    return None
+                with self._lock:
+                    self.held.add(lease)
+                return lease
+            if lease.is_stale():
+                lease.break_stale()
+                continue
+            time.sleep(delay)
+            delay = min(delay * 1.5, 2.0)
+
+    def release(self, lease: ChiveLease):
+        with self._lock:
+            if lease not in self.held:
+                return
+            self.held.discard(lease)
+        lease.release()
+
+    def shutdown(self):
+        self._stop.set()
+        with self._lock:
+            held, self.held = list(self.held), set()
+        for lease in held:
+            lease.release()
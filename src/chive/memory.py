@@ -0,0 +1,75 @@
+from collections import Counter, OrderedDict
+from typing import *
+
+from .io import checkpoint_key, get_item_node_params
+from .lazy import ChiveLazyFunc
+from .utils import estimate_size
+
+
+class ChiveMemory:
+    """
+    Frees resolved node values that are no longer needed.
+
+    At collection time every remaining test is counted against the node instances it
+    uses, and a value is dropped as soon as the last of those tests has finished. With a
+    max_bytes budget, reloadable values (i.e. checkpoints) are additionally evicted in
+    least-recently-used order whenever the tracked values exceed it.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.item_nodes: Dict[str, Dict[str, str]] = {}
+        self.refcounts: Counter = Counter()
+        # Live values by node instance key, least recently used first
+        self.values: "OrderedDict[str, ChiveLazyFunc]" = OrderedDict()
+        self.sizes: Dict[str, int] = {}
+
+    def count(self, items):
+        for item in items:
+            nodes = {
+                name: checkpoint_key(name, params)
+                for name, params in get_item_node_params(item).items()
+            }
+            self.item_nodes[item.nodeid] = nodes
+            self.refcounts.update(nodes.values())
+
+    def use(self, item):
+        """Record the node values an item has just set up and resolved."""
+        nodes = self.item_nodes.get(item.nodeid, {})
+        for name, key in nodes.items():
+            fixturedefs = item._fixtureinfo.name2fixturedefs.get(name)
+            cached_result = fixturedefs[-1].cached_result if fixturedefs else None
+            if cached_result is None or not isinstance(cached_result[0], ChiveLazyFunc):
+                continue
+            lazy_func = cached_result[0]
+            self.values[key] = lazy_func
+            self.values.move_to_end(key)
+            if lazy_func.cached:
+                self.sizes[key] = estimate_size(lazy_func.cache_val)
+        self.enforce(protect=set(nodes.values()))
+
+    def release(self, item):
+        """Called once an item has finished; drops values no remaining test needs."""
+        for key in self.item_nodes.pop(item.nodeid, {}).values():
+            self.refcounts[key] -= 1
+            if self.refcounts[key] <= 0:
+                del self.refcounts[key]
+                self._evict(key)
+
+    def enforce(self, protect: Collection[str] = ()):
+        if self.max_bytes is None:
+            return
+        total = sum(self.sizes.values())
+        for key in list(self.values):
+            if total <= self.max_bytes:
+                break
+            if key in protect or self.values[key].reload is None:
+                continue
+            total -= self.sizes.get(key, 0)
+            self._evict(key)
+
+    def _evict(self, key: str):
+        lazy_func = self.values.pop(key, None)
+        self.sizes.pop(key, None)
+        if lazy_func is not None:
+            lazy_func.evict()
@@ -1,9 +1,160 @@
+from concurrent.futures import Executor, Future
+import hashlib
+from io import BytesIO
+import os
 from pathlib import Path
+import pickle
+from typing import *
 import pytest
 
+from .io import _tmp_path
+from .process import process_pool
+
+__all__ = ["ChiveFigureRenderer", "figure_renderer", "figsaver", "fig", "ax"]
+
+
+def _hash_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}.sha256")
+
+
+def _write_figure(fig, path: str | Path, fmt: str, dpi: float):
+    # Render next to the destination and rename, so an interrupted save leaves no
+    # half-written file that could later be taken as up to date
+    tmp_path = _tmp_path(path)
+    fig.savefig(tmp_path, format=fmt, dpi=dpi, bbox_inches="tight", transparent=True)
+    os.replace(tmp_path, path)
+
+
+def _digest(fig, fmt: str, dpi: float) -> str:
+    """
+    Hash of what a figure draws, stable across sessions: that of an SVG render with
+    deterministic ids and no date, not of the pickled figure, whose state includes
+    id()-keyed transform references.
+    """
+    import matplotlib
+
+    buffer = BytesIO()
+    with matplotlib.rc_context({"svg.hashsalt": "chive"}):
+        fig.savefig(buffer, format="svg", metadata={"Date": None})
+    h = hashlib.sha256(buffer.getvalue())
+    h.update(f"\0{fmt}\0{dpi}".encode())
+    return h.hexdigest()
+
+
+def _save_figure(fig, path: Path, fmt: str, dpi: float, hash_new: bool) -> bool:
+    """
+    Render fig to path unless the hash recorded with the file shows it is unchanged;
+    returns whether it was rendered. Hashing a figure draws it, so a figure without an
+    existing file to compare to is only hashed (for next time) if hash_new.
+    """
+    digest = None
+    if path.exists() or hash_new:
+        digest = _digest(fig, fmt, dpi)
+        if path.exists() and _recorded(path) == digest:
+            return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _hash_path(path).unlink(missing_ok=True)
+    _write_figure(fig, path, fmt, dpi)
+    if digest is not None:
+        _hash_path(path).write_text(digest)
+    return True
+
+
+def _recorded(path: Path) -> Optional[str]:
+    try:
+        return _hash_path(path).read_text()
+    except OSError:
+        return None
+
+
+def _render(data: bytes, path: str, fmt: str, dpi: float) -> bool:
+    """Save a pickled figure in a worker process, as _save_figure."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig = pickle.loads(data)
+    try:
+        return _save_figure(fig, Path(path), fmt, dpi, hash_new=True)
+    finally:
+        plt.close(fig)
+
+
+class ChiveFigureRenderer:
+    """
+    Saves figures for figsaver, skipping any whose content hash matches the one
+    recorded when its file was last written. With workers, figures are pickled and
+    hashed and rendered in a process pool instead of in the test that made them.
+    Otherwise, a figure is only hashed once it has a file to compare to, so that
+    new figures are drawn once; they are skipped from the session after next.
+    """
+
+    def __init__(self, fmt: str = "png", dpi: float = 300, workers: int = 0):
+        self.fmt = fmt
+        self.dpi = dpi
+        self.workers = workers
+        self.executor: Optional[Executor] = None
+        self.pending: List[Tuple[str, Future]] = []
+        self.skipped = 0
+
+    def save(self, fig, path: str | Path):
+        path = Path(path)
+        data = None
+        if self.workers > 0:
+            try:
+                data = pickle.dumps(fig)
+            except Exception:
+                # Some artists can't be pickled; those are always rendered here
+                pass
+        if data is None:
+            if not _save_figure(fig, path, self.fmt, self.dpi, hash_new=False):
+                self.skipped += 1
+            return
+        if self.executor is None:
+            self.executor = process_pool(self.workers)
+        future = self.executor.submit(_render, data, str(path), self.fmt, self.dpi)
+
+        def on_done(future: Future):
+            if future.exception() is None and not future.result():
+                self.skipped += 1
+
+        future.add_done_callback(on_done)
+        self.pending.append((str(path), future))
+
+    def close(self) -> List[Tuple[str, BaseException]]:
+        """Wait for queued renders; returns (path, error) for those that failed."""
+        errors = [
+            (path, future.exception())
+            for path, future in self.pending
+            if future.exception() is not None
+        ]
+        self.pending = []
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        return errors
+
+
+@pytest.fixture(scope="session")
+def figure_renderer(request):
+    renderer = ChiveFigureRenderer(
+        fmt=request.config.getoption("--savefig-format"),
+        dpi=request.config.getoption("--savefig-dpi"),
+        workers=request.config.getoption("--savefig-workers"),
+    )
+    yield renderer
+    errors = renderer.close()
+    if errors:
+        pytest.fail(
+            f"{len(errors)} figure(s) failed to render:\n"
+            + "\n".join(f"{path}: {type(e).__name__}: {e}" for path, e in errors),
+            pytrace=False,
+        )
+
 
 @pytest.fixture(scope="function")  # type: ignore
-def figsaver(request, dataset: str, exp_name: str):
+def figsaver(request, dataset: str, exp_name: str, figure_renderer):
     import matplotlib.pyplot as plt
 
     save = request.config.getoption("--savefig")
@@ -12,14 +163,8 @@ def figsaver(request, dataset: str, exp_name: str):
         path = f"chive_output/{dataset}/{exp_name}/{request.node.name.replace('test_', '').split('[')[0]}"
         if idx is not None:
             path += f"/{idx}"
-        path += ".png"
-        Path(path).parent.mkdir(parents=True, exist_ok=True)
-        fig.savefig(
-            path,
-            dpi=300,
-            bbox_inches="tight",
-            transparent=True,
-        )
+        path += f".{figure_renderer.fmt}"
+        figure_renderer.save(fig, path)
 
     if save:
         with plt.ioff():
@@ -1,4 +1,5 @@
 import decorator
+import inspect
 from pathlib import Path
 import pytest
 import types
@@ -19,6 +20,8 @@ def node(lazy: bool | Callable = True):
         def wrapper(func, *args, **kwargs):
             return ChiveLazyFunc(func, *args, **kwargs)
 
+        if lazy:
+            func._chive_node = True
         maybe_wrapped_func = decorator.decorator(wrapper, func) if lazy else func
 
         return pytest.fixture(maybe_wrapped_func, scope=default_scope)  # type: ignore
@@ -26,17 +29,37 @@ def node(lazy: bool | Callable = True):
     return deco
 
 
-def checkpoint(recompute: bool | Literal["error"] | Callable = False, replicate=None):
+def checkpoint(
+    recompute: bool | Literal["error"] | Callable = False,
+    replicate=None,
+    compress: Optional[str | Literal[False]] = None,
+    executor: Optional[Literal["process"]] = None,
+):
     if not isinstance(recompute, bool) and recompute != "error":
         # Handle case where decorator is called without arguments
         return checkpoint()(recompute)  # type: ignore
 
+    if replicate is not None and (not isinstance(replicate, int) or replicate < 1):
+        raise ValueError(f"replicate must be a positive number, got {replicate!r}")
+
+    if executor not in (None, "process"):
+        raise ValueError(f"Unknown checkpoint executor {executor!r}")
+
     def deco(func):
+        if inspect.isgeneratorfunction(func):
+            if replicate is not None:
+                raise ValueError("Streaming nodes can't be replicated")
+            if executor is not None:
+                raise ValueError("Streaming nodes can't run in another process")
         func._chive_checkpoint = {
             "recompute": recompute,
         }
         if replicate is not None:
             func._chive_checkpoint["replicate"] = replicate
+        if compress is not None:
+            func._chive_checkpoint["compress"] = compress
+        if executor is not None:
+            func._chive_checkpoint["executor"] = executor
 
         return node(func)
 
@@ -0,0 +1,115 @@
+from typing import *
+
+from .io import (
+    ChiveIO,
+    _disk_size,
+    checkpoint_key,
+    get_checkpoint_dir,
+    get_code_fingerprint,
+    get_item_node_params,
+)
+from .utils import format_size
+
+
+class PlannedNode(NamedTuple):
+    name: str
+    key: str
+    # "load" from a checkpoint, "compute", or "missing" for recompute="error" checkpoints
+    action: str
+    checkpoint: bool
+    size: Optional[int] = None
+    compute_time: Optional[float] = None
+
+
+def plan_item(item, io: ChiveIO, force_recompute: bool = False) -> List[PlannedNode]:
+    """
+    Work out what running a collected item would do, following the same rules as
+    ChivePlugin: starting from the test's own arguments, a checkpoint that exists on
+    disk, and was computed by the current code, is loaded and nothing above it is
+    touched; everything else is computed.
+    """
+    info = item._fixtureinfo
+    node_params = get_item_node_params(item)
+    planned: Dict[str, PlannedNode] = {}
+    try:
+        item_params = item.callspec.params
+    except AttributeError:
+        item_params = {}
+
+    def get_fixturedef(name):
+        fixturedefs = info.name2fixturedefs.get(name)
+        return fixturedefs[-1] if fixturedefs else None
+
+    def visit(name: str):
+        if name in planned or name not in node_params:
+            return
+        fixturedef = info.name2fixturedefs[name][-1]
+        params = node_params[name]
+        key = checkpoint_key(name, params)
+        ckpt_data = getattr(fixturedef.func, "_chive_checkpoint", None)
+        if ckpt_data is None:
+            planned[name] = PlannedNode(name, key, "compute", checkpoint=False)
+        else:
+            save_path = get_checkpoint_dir(name, params)
+            code = get_code_fingerprint(fixturedef, get_fixturedef, item_params)
+            found = io.find_current(
+                f"{save_path}/{name}", code, ckpt_data.get("replicate")
+            )
+            manifest = io.read_manifest(save_path) or {}
+            compute_time = manifest.get("compute_time")
+            recompute = ckpt_data["recompute"] == True or force_recompute
+            if found is not None and not recompute:
+                # Unknown for checkpoints that would be downloaded from a remote store
+                size = _disk_size(found[1]) if found[1].exists() else None
+                planned[name] = PlannedNode(
+                    name, key, "load", True, size=size, compute_time=compute_time
+                )
+                return
+            action = "missing" if ckpt_data["recompute"] == "error" else "compute"
+            planned[name] = PlannedNode(
+                name, key, action, True, compute_time=compute_time
+            )
+        for argname in fixturedef.argnames:
+            visit(argname)
+
+    for argname in info.argnames:
+        visit(argname)
+    return list(planned.values())
+
+
+def _describe(nodes: Iterable[PlannedNode]) -> str:
+    nodes = list(nodes)
+    loads = [n for n in nodes if n.action == "load"]
+    computes = [n for n in nodes if n.action == "compute"]
+    missing = [n for n in nodes if n.action == "missing"]
+    known = [n.compute_time for n in computes if n.compute_time is not None]
+    parts = [
+        f"{len(loads)} load ({format_size(sum(n.size or 0 for n in loads))})",
+        f"{len(computes)} compute"
+        + (f" (~{sum(known):.1f}s for {len(known)} timed)" if known else ""),
+    ]
+    if missing:
+        parts.append(f"{len(missing)} missing")
+    return ", ".join(parts)
+
+
+def report_plan(terminalreporter, plans: Dict[str, List[PlannedNode]]):
+    terminalreporter.section("chive plan")
+    verbose = terminalreporter.config.getoption("verbose") > 0
+    for nodeid, nodes in plans.items():
+        terminalreporter.line(f"{nodeid}: {_describe(nodes)}")
+        if verbose:
+            for node in nodes:
+                details = []
+                if node.size is not None:
+                    details.append(format_size(node.size))
+                if node.compute_time is not None:
+                    details.append(f"last computed in {node.compute_time:.2f}s")
+                kind = "checkpoint" if node.checkpoint else "node"
+                terminalreporter.line(
+                    f"    {node.action:<8}{kind} {node.name}[{node.key}]"
+                    + (f" ({', '.join(details)})" if details else "")
+                )
+    # Node instances are shared between tests, so each one only happens once
+    unique = {(n.name, n.key): n for nodes in plans.values() for n in nodes}
+    terminalreporter.line(f"total for {len(plans)} tests: {_describe(unique.values())}")
@@ -1,15 +1,42 @@
 from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor
 import decorator
 import importlib
+import inspect
+import os
 from pathlib import Path
 import pytest
+import threading
 from typing import *  # type: ignore
-import yaml
 
-from .lazy import ChiveLazyFunc, _resolve
-from .io import get_save_path, ChiveIO
+from .lazy import ChiveLazyFunc, _resolve, set_executor, set_profiler
+from .io import (
+    get_save_path,
+    get_save_params,
+    get_save_manifest,
+    get_item_checkpoint_params,
+    get_code_fingerprint,
+    checkpoint_key,
+    set_checkpoint_overrides,
+    ChiveIO,
+    CHIVE_DIR,
+    _canonicalize,
+)
+from .config import load_config
 from .nodes import default_scope, param
-from .utils import ChiveInternalError
+from .sweep import sweep
+from .utils import ChiveCachedFailure, ChiveInternalError, format_size, parse_size
+from .incremental import ChiveOutcomes
+from .index import ChiveIndex
+from .locks import ChiveLocks
+from .memory import ChiveMemory
+from .plan import PlannedNode, plan_item, report_plan
+from .prefetch import ChivePrefetcher
+from .profile import ChiveProfiler
+from .remote import open_store
+from .process import process_pool, run_in_process
+from .replicate import run_replicates
+from .writer import ChiveWriter
 
 # Need to import fixtures located in here:
 from .mpl import *
@@ -24,19 +51,52 @@ def pytest_plugin_registered(plugin, plugin_name, manager):
 class ChivePlugin:
     def __init__(self, force_recompute=False):
         self.params = {}
+        self.sweeps: Dict[str, sweep] = {}
         self.force_recompute = force_recompute
+        self.compression: Optional[str] = None
+        self.cache_failures = False
+        self.retry_failures = False
         self.IO = ChiveIO()
+        self.index: Optional[ChiveIndex] = None
+        self.writer: Optional[ChiveWriter] = None
+        self.executor: Optional[Executor] = None
+        # Process pool for replicated and out-of-process checkpoints, started when
+        # first needed
+        self.process_workers: Optional[int] = None
+        self.process_executor: Optional[Executor] = None
+        self._process_lock = threading.Lock()
+        self.locks: Optional[ChiveLocks] = None
+        self.memory: Optional[ChiveMemory] = None
+        self.prefetcher: Optional[ChivePrefetcher] = None
+        # Recorded outcomes of output tests, with --chive-incremental
+        self.outcomes: Optional[ChiveOutcomes] = None
+        self.fingerprints: Dict[str, Optional[str]] = {}
+        self.item_outcomes: Dict[str, str] = {}
+        self.profiler: Optional[ChiveProfiler] = None
+        self.profile_path: Optional[str] = None
+        self.plans: Optional[Dict[str, List[PlannedNode]]] = None
+        self.save_errors: List[Tuple[str, BaseException]] = []
         self.main_workflows: List[str] = []
         self.sub_workflows: List[str] = []
 
         self.checkpoint_parameter_overrides = defaultdict(dict)
+        # Checkpoint instances set up this session, by save name, so that fixture
+        # instances that override parameters down to the same key share one
+        self.instances: Dict[str, ChiveLazyFunc] = {}
 
         self.manager = None
 
     def pytest_plugin_registered(self, plugin, plugin_name, manager):
-        for name, obj in plugin.__dict__.items():
-            if isinstance(obj, param):
-                self._load_param(name, obj, overwrite=False)
+        # Every plugin pytest registers comes through here, but params can only be
+        # defined in workflow modules and conftests
+        if plugin_name in self.main_workflows or plugin_name in self.sub_workflows or (
+            os.path.basename(getattr(plugin, "__file__", None) or "") == "conftest.py"
+        ):
+            for name, obj in vars(plugin).items():
+                if isinstance(obj, param):
+                    self._load_param(name, obj, overwrite=False)
+                elif isinstance(obj, sweep):
+                    self._load_sweep(name, obj, overwrite=False)
 
         if plugin_name == "chive_sub":
             self.manager = manager
@@ -55,34 +115,310 @@ class ChivePlugin:
             default=False,
             help="save figures from tests",
         )
+        parser.addoption(
+            "--savefig-format",
+            default="png",
+            help="file format of figures saved with --savefig (default png)",
+        )
+        parser.addoption(
+            "--savefig-dpi",
+            type=float,
+            default=300,
+            help="resolution of figures saved with --savefig (default 300)",
+        )
+        parser.addoption(
+            "--savefig-workers",
+            type=int,
+            default=0,
+            help="render figures saved with --savefig in a pool of N processes "
+            "instead of in the tests that made them",
+        )
+        parser.addoption(
+            "--chive-writers",
+            type=int,
+            default=0,
+            help="number of background checkpoint writer threads (default 0: save "
+            "inline); checkpoint values must then not be modified in place downstream",
+        )
+        parser.addoption(
+            "--chive-write-buffer",
+            type=float,
+            default=1024,
+            help="MB of checkpoint values allowed to queue for writing before blocking",
+        )
+        parser.addoption(
+            "--chive-workers",
+            type=int,
+            default=0,
+            help="resolve independent upstream nodes concurrently with N workers",
+        )
+        parser.addoption(
+            "--chive-executor",
+            choices=["thread", "process"],
+            default="thread",
+            help="kind of worker pool used by --chive-workers",
+        )
+        parser.addoption(
+            "--chive-process-workers",
+            type=int,
+            default=None,
+            help="size of the process pool for checkpoint(replicate=N) and "
+            'checkpoint(executor="process") nodes (default one per CPU, 0 to '
+            "compute them in this process)",
+        )
+        parser.addoption(
+            "--chive-lock",
+            action="store_true",
+            default=False,
+            help="coordinate checkpoint computation with other processes sharing "
+            "the checkpoint directory (always on under pytest-xdist)",
+        )
+        parser.addoption(
+            "--chive-cache-failures",
+            action="store_true",
+            default=False,
+            help="remember checkpoints whose computation failed and report the "
+            "failure in later sessions instead of computing them again, until "
+            "their code changes",
+        )
+        parser.addoption(
+            "--chive-retry-failures",
+            action="store_true",
+            default=False,
+            help="compute checkpoints again even if they failed last time",
+        )
+        parser.addoption(
+            "--chive-no-reorder",
+            dest="chive_reorder",
+            action="store_false",
+            default=True,
+            help="don't group tests that share upstream checkpoints",
+        )
+        parser.addoption(
+            "--chive-max-memory",
+            default=None,
+            help="evict least recently used checkpointed values to stay under this "
+            "size (e.g. 16G); they are reloaded from disk if needed again",
+        )
+        parser.addoption(
+            "--chive-prefetch",
+            type=int,
+            default=0,
+            metavar="N",
+            help="load the checkpoints needed by the next N tests in the background "
+            "while the current one runs",
+        )
+        parser.addoption(
+            "--chive-prefetch-buffer",
+            type=float,
+            default=1024,
+            help="MB of prefetched checkpoint values allowed to wait for their tests",
+        )
+        parser.addoption(
+            "--chive-incremental",
+            action="store_true",
+            default=False,
+            help="skip output tests that passed last time with identical inputs "
+            "(checkpoint contents, parameters and code)",
+        )
+        parser.addoption(
+            "--chive-profile",
+            action="store_true",
+            default=False,
+            help="time every node's compute, load and save, and show the slowest nodes",
+        )
+        parser.addoption(
+            "--chive-profile-path",
+            default=None,
+            metavar="PATH",
+            help="also write the --chive-profile report, a JSON report / Chrome trace, "
+            "to PATH (implies --chive-profile)",
+        )
+        parser.addoption(
+            "--chive-plan",
+            action="store_true",
+            default=False,
+            help="only report which checkpoints each selected test would load and "
+            "which nodes it would compute, without running anything",
+        )
+        parser.addoption(
+            "--chive-remote",
+            default=None,
+            metavar="URL",
+            help="share checkpoints through a store at URL (http(s)://, s3://bucket/"
+            "prefix, or a directory): missing ones are downloaded, new ones uploaded",
+        )
+        parser.addoption(
+            "--chive-gc",
+            default=None,
+            metavar="SIZE",
+            help="only delete least recently used checkpoints until the rest fit in "
+            "SIZE (e.g. 50G), without running anything",
+        )
+        parser.addoption(
+            "--chive-no-index",
+            dest="chive_index",
+            action="store_false",
+            default=True,
+            help="don't keep an index of checkpoints (look them up on disk instead)",
+        )
         parser.addini("workflows", help="Main workflow(s)", default=[], type="args")
         parser.addini(
             "chive_config", help="Chive Configuration File(s)", default=[], type="args"
         )
 
+    def pytest_cmdline_main(self, config):
+        if config.getoption("--chive-gc") is not None and not config.option.help:
+            from _pytest.main import wrap_session
+
+            return wrap_session(config, self._collect_garbage)
+
     def pytest_configure(self, config):
         config.addinivalue_line("markers", "chive_output: Chive output node")
 
         self.main_workflows = config.getini("workflows")
+        remote = None
         # Note: passing file(s) into the command line options will overwrite the ini settings
         chive_configs = config.getoption("--chive_config") or config.getini(
             "chive_config"
         )
         for chive_config in chive_configs:
-            with open(chive_config) as f:
-                cfg = yaml.safe_load(f)
+            cfg = load_config(chive_config)
             if "workflows" in cfg:
                 self.sub_workflows.extend(cfg["workflows"])
             if "parameters" in cfg:
                 for name, vals in cfg["parameters"].items():
-                    self._load_param(name, param(vals), overwrite=True)
+                    # A single value may be given without a list around it
+                    vals = vals if isinstance(vals, list) else [vals]
+                    self._load_param(name, param(*vals), overwrite=True)
+            if "sweeps" in cfg:
+                for name, spec in cfg["sweeps"].items():
+                    self._load_sweep(name, sweep.from_config(spec), overwrite=True)
             if "checkpoints" in cfg:
                 for name, vals in cfg["checkpoints"].items():
-                    self.checkpoint_parameter_overrides[name].update(vals)
+                    self._load_checkpoint_overrides(name, vals)
             if "recompute" in cfg:
                 self.force_recompute = cfg["recompute"]
+            if "compression" in cfg:
+                self.compression = cfg["compression"]
+            if "remote" in cfg:
+                remote = cfg["remote"]
 
         self._load_workflows()
+        set_checkpoint_overrides(self.checkpoint_parameter_overrides)
+
+        if config.getoption("chive_index"):
+            self.index = ChiveIndex()
+            self.IO.index = self.index
+
+        remote = config.getoption("--chive-remote") or remote
+        if remote is not None:
+            self.IO.remote = open_store(remote)
+
+        self.writer = ChiveWriter(
+            self.IO,
+            workers=config.getoption("--chive-writers"),
+            max_queued_bytes=int(config.getoption("--chive-write-buffer") * 2**20),
+        )
+
+        self.profile_path = config.getoption("--chive-profile-path")
+        if config.getoption("--chive-profile") or self.profile_path is not None:
+            self.profiler = ChiveProfiler()
+            self.IO.observer = self.profiler.io
+            set_profiler(self.profiler.compute)
+
+        max_memory = config.getoption("--chive-max-memory")
+        self.memory = ChiveMemory(
+            max_bytes=parse_size(max_memory) if max_memory is not None else None
+        )
+
+        if config.getoption("--chive-incremental"):
+            self.outcomes = ChiveOutcomes(self.IO)
+
+        prefetch = config.getoption("--chive-prefetch")
+        if prefetch > 0:
+            self.prefetcher = ChivePrefetcher(
+                self.IO,
+                depth=prefetch,
+                max_bytes=int(config.getoption("--chive-prefetch-buffer") * 2**20),
+            )
+
+        if config.getoption("--chive-lock") or "PYTEST_XDIST_WORKER" in os.environ:
+            self.locks = ChiveLocks()
+
+        workers = config.getoption("--chive-workers")
+        if workers > 0:
+            if config.getoption("--chive-executor") == "process":
+                self.executor = process_pool(workers)
+            else:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="chive-worker"
+                )
+            set_executor(self.executor)
+        self.process_workers = config.getoption("--chive-process-workers")
+        self.cache_failures = config.getoption("--chive-cache-failures")
+        self.retry_failures = config.getoption("--chive-retry-failures")
+
+    def pytest_sessionfinish(self, session, exitstatus):
+        if self.writer is None:
+            return
+        self.save_errors = self.writer.drain()
+        if self.save_errors and session.exitstatus == pytest.ExitCode.OK:
+            session.exitstatus = pytest.ExitCode.TESTS_FAILED
+
+        if self.outcomes is not None and self.item_outcomes:
+            # Fingerprint what ran now that its checkpoints have all been written
+            for item in session.items:
+                outcome = self.item_outcomes.get(item.nodeid)
+                if outcome is not None:
+                    fingerprint = self.outcomes.fingerprint(item, self.force_recompute)
+                    self.outcomes.record(item.nodeid, fingerprint, outcome)
+            self.outcomes.save()
+
+        if self.profiler is not None and self.profile_path:
+            self.profiler.write(self.profile_path)
+
+    def pytest_terminal_summary(self, terminalreporter, exitstatus, config):
+        if self.plans is not None:
+            report_plan(terminalreporter, self.plans)
+        if self.profiler is not None:
+            self.profiler.terminal_summary(terminalreporter)
+            if self.profile_path:
+                terminalreporter.line(f"chive profile written to {self.profile_path}")
+        if not self.save_errors:
+            return
+        terminalreporter.section("chive checkpoint errors", red=True)
+        for save_name, error in self.save_errors:
+            terminalreporter.line(f"{save_name}: {type(error).__name__}: {error}")
+
+    def pytest_unconfigure(self, config):
+        if self.profiler is not None:
+            set_profiler(None)
+            self.IO.observer = None
+            self.profiler = None
+        if self.locks is not None:
+            self.locks.shutdown()
+            self.locks = None
+        if self.executor is not None:
+            set_executor(None)
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.process_executor is not None:
+            self.process_executor.shutdown(wait=True)
+            self.process_executor = None
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+            self.prefetcher = None
+        if self.writer is not None:
+            self.writer.shutdown()
+            self.writer = None
+        self.IO.remote = None
+        set_checkpoint_overrides(None)
+        self.instances = {}
+        if self.index is not None:
+            self.IO.index = None
+            self.index.close()
+            self.index = None
 
     def pytest_collect_file(self, file_path, parent):
         pass
@@ -95,43 +431,287 @@ class ChivePlugin:
             return list(collector._genfunctions(name, obj))
 
     def pytest_generate_tests(self, metafunc):
+        swept = set()
+        for sw in self.sweeps.values():
+            used = metafunc.fixturenames
+            columns = [i for i, name in enumerate(sw.names) if name in used]
+            if not columns:
+                continue
+            names = [sw.names[i] for i in columns]
+            swept.update(names)
+            # Tests that only use some of a sweep's parameters get each distinct
+            # combination of those once
+            rows = {}
+            for row in sw.table:
+                values = tuple(row[i] for i in columns)
+                rows.setdefault(_canonicalize(values), values)
+            metafunc.parametrize(names, list(rows.values()), scope=default_scope)
         for name, vals in self.params.items():
-            if name in metafunc.fixturenames:
+            if name in metafunc.fixturenames and name not in swept:
                 metafunc.parametrize(
                     name,
                     vals,
                     scope=default_scope,
                 )
 
+    @pytest.hookimpl(trylast=True)
+    def pytest_collection_modifyitems(self, session, config, items):
+        if not config.getoption("chive_reorder"):
+            return
+        # Only items that use checkpoints are moved, and only among their own slots
+        slots = []
+        item_keys = []
+        for i, item in enumerate(items):
+            checkpoints = get_item_checkpoint_params(item)
+            if not checkpoints:
+                continue
+            # The most widely shared (least parametrized) checkpoints come first, so
+            # items are grouped by those before anything more specific
+            ordered = sorted(checkpoints.items(), key=lambda kv: (len(kv[1]), kv[0]))
+            slots.append(i)
+            item_keys.append([checkpoint_key(name, params) for name, params in ordered])
+
+        # Groups keep the relative order in which pytest first reached them
+        first_seen: Dict[str, int] = {}
+        for keys in item_keys:
+            for key in keys:
+                first_seen.setdefault(key, len(first_seen))
+        order = sorted(
+            range(len(slots)),
+            key=lambda j: ([first_seen[key] for key in item_keys[j]], j),
+        )
+        reordered = [items[slots[j]] for j in order]
+        for slot, item in zip(slots, reordered):
+            items[slot] = item
+
+    def pytest_collection_finish(self, session):
+        self.memory.count(session.items)
+        if self.outcomes is not None:
+            self.fingerprints = {
+                item.nodeid: self.outcomes.fingerprint(item, self.force_recompute)
+                for item in session.items
+                if item.get_closest_marker("chive_output") is not None
+            }
+        if session.config.getoption("--chive-plan"):
+            self.plans = {
+                item.nodeid: plan_item(item, self.IO, self.force_recompute)
+                for item in session.items
+            }
+        elif self.IO.remote is not None or self.prefetcher is not None:
+            loads = [
+                (
+                    item.nodeid,
+                    [
+                        f"{CHIVE_DIR}/{node.name}/{node.key}/{node.name}"
+                        for node in plan_item(item, self.IO, self.force_recompute)
+                        if node.action == "load"
+                    ],
+                )
+                for item in session.items
+            ]
+            if self.IO.remote is not None:
+                # Start downloading every checkpoint the run is going to load
+                self.IO.prefetch(name for _, names in loads for name in names)
+            if self.prefetcher is not None:
+                self.prefetcher.plan(loads)
+
+    def pytest_runtestloop(self, session):
+        if self.plans is not None:
+            # Dry run: the plan is reported in the terminal summary instead
+            return True
 
     def pytest_fixture_setup(self, fixturedef, request):
         if hasattr(fixturedef.func, "_chive_checkpoint"):
             save_path = get_save_path(request)
-            save_name = f"{save_path}/{fixturedef.argname}.pkl"
+            save_name = f"{save_path}/{fixturedef.argname}"
+            # we're going to need to put the original function back after the test
+            fixturedef._chive_old_func = fixturedef.func
+            if save_name in self.instances:
+                # Same key as an instance set up for other parameters, which it ignores
+                # or pins, so share that one
+                instance = self.instances[save_name]
+                fixturedef.func = lambda *args, **kwargs: instance
+                return
+            manifest = get_save_manifest(fixturedef.argname, get_save_params(request))
+            # Checkpoints computed by since-edited code (here or upstream) are stale
+            code = get_code_fingerprint(
+                fixturedef,
+                request._fixture_defs.get,
+                get_save_params(request, filter_dependencies=False),
+            )
+            manifest["code"] = code
             ckpt_data = fixturedef.func._chive_checkpoint
-            if not (ckpt_data["recompute"] == True or self.force_recompute):
+            pinned = self._pinned_params(fixturedef, request)
+            key = Path(save_path).name
+            # A write of this checkpoint may still be queued from earlier in the session
+            self.writer.wait(save_name)
+            recompute = ckpt_data["recompute"] == True or self.force_recompute
+            if not recompute:
+                replicates = ckpt_data.get("replicate")
+                if self.IO.find_current(save_name, code, replicates) is not None:
+                    if self.profiler is not None:
+                        self.profiler.mark(fixturedef.argname, key, "hit")
 
-                try:
-                    val = self.IO.load(save_name)
-                    print(f"Loaded {fixturedef.argname} from checkpoint")
+                    # Defer the actual read until something resolves this node, so
+                    # intermediate checkpoints below a loaded one are never touched
+                    def load():
+                        staged, val = False, None
+                        if self.prefetcher is not None:
+                            staged, val = self.prefetcher.take(save_name)
+                        if not staged:
+                            val = self.IO.load(save_name)
+                        print(f"Loaded {fixturedef.argname} from checkpoint")
+                        return val
 
                     def cache_func(*args, **kwargs):
-                        return val
+                        lazy_func = ChiveLazyFunc(load)
+                        # Loading is reported by the IO observer, not as a computation
+                        lazy_func.name = None
+                        lazy_func.reload = load
+                        self.instances[save_name] = lazy_func
+                        return lazy_func
 
-                    # we're going to need to put the original function back after the test
-                    fixturedef._chive_old_func = fixturedef.func
                     fixturedef.func = cache_func
-                except Exception:
-                    if ckpt_data["recompute"] == "error":
-                        raise
+                    return
+                failure = None
+                if self.cache_failures and not self.retry_failures:
+                    failure = self.IO.find_failure(save_name, code)
+                if failure is not None:
+                    if self.profiler is not None:
+                        self.profiler.mark(fixturedef.argname, key, "failed")
+
+                    def fail():
+                        raise ChiveCachedFailure(fixturedef.argname, failure)
+
+                    def failed_func(*args, **kwargs):
+                        lazy_func = ChiveLazyFunc(fail)
+                        lazy_func.name = None
+                        return lazy_func
+
+                    fixturedef.func = failed_func
+                    return
+                if ckpt_data["recompute"] == "error":
+                    raise FileNotFoundError(
+                        f"No checkpoint for {fixturedef.argname} at {save_name}"
+                    )
+
+            if self.profiler is not None:
+                if recompute:
+                    status = "recompute"
+                else:
+                    status = "stale" if self.IO.exists(save_name) else "miss"
+                self.profiler.mark(fixturedef.argname, key, status)
 
             # Add a wrapper to save the value when it's computed
             # Have to be careful not to save multiple times because we're outside the lazy function that caches
             def wrapper(func, *args, **kwargs):
+                if pinned:
+                    bound = inspect.signature(func).bind(*args, **kwargs)
+                    bound.arguments.update(pinned)
+                    args, kwargs = bound.args, bound.kwargs
                 lazy_func = func(*args, **kwargs)
                 if not isinstance(lazy_func, ChiveLazyFunc):
                     raise ChiveInternalError("why?")
-                lazy_func.save_callback = lambda val: self.IO.save(val, save_name)
+                lazy_func.name = fixturedef.argname
+                lazy_func.key = key
+
+                def save(val, on_done=None):
+                    self.writer.submit(
+                        val,
+                        save_name,
+                        manifest={**manifest, "compute_time": lazy_func.compute_time},
+                        compress=ckpt_data.get("compress", self.compression),
+                        on_done=on_done,
+                    )
+
+                def reload():
+                    self.writer.wait(save_name)
+                    return self.IO.load(save_name)
+
+                lazy_func.save_callback = save
+                self.instances[save_name] = lazy_func
+                if self.cache_failures:
+                    lazy_func.error_callback = lambda e: self.IO.record_failure(
+                        save_name, e, code
+                    )
+                if lazy_func.streaming:
+                    generate = lazy_func.func
+
+                    # Chunks are checkpointed as they are produced, not all at once
+                    def stream(*args, **kwargs):
+                        return self.IO.save_stream(
+                            generate(*args, **kwargs),
+                            save_name,
+                            manifest=manifest,
+                            compress=ckpt_data.get("compress", self.compression),
+                        )
+
+                    lazy_func.func = stream
+                    lazy_func.save_callback = None
+                elif ckpt_data.get("replicate"):
+                    compute = lazy_func.func
+
+                    # Each replicate is checkpointed as soon as it is computed
+                    def replicated(*args, **kwargs):
+                        return self.IO.save_replicates(
+                            lambda missing: run_replicates(
+                                compute, missing, args, kwargs, self._process_pool()
+                            ),
+                            ckpt_data["replicate"],
+                            save_name,
+                            manifest=manifest,
+                            compress=ckpt_data.get("compress", self.compression),
+                        )
+
+                    lazy_func.func = replicated
+                    lazy_func.save_callback = None
+                elif (
+                    ckpt_data.get("executor") == "process"
+                    and "<locals>" not in lazy_func.func.__qualname__
+                    and self.process_workers != 0
+                ):
+                    compute = lazy_func.func
+
+                    # The worker writes the checkpoint, which is then mapped from disk
+                    def in_process(*args, **kwargs):
+                        return run_in_process(
+                            self._process_pool(),
+                            self.IO,
+                            compute,
+                            args,
+                            kwargs,
+                            save_name,
+                            manifest=manifest,
+                            compress=ckpt_data.get("compress", self.compression),
+                        )
+
+                    lazy_func.func = in_process
+                    lazy_func.save_callback = None
+                if self.locks is None or recompute:
+                    lazy_func.reload = reload
+                    return lazy_func
+
+                # Hide lazy_func from argument resolution, so that a process that
+                # ends up loading another's result never computes its inputs
+                def coordinated():
+                    return self._coordinate(
+                        lazy_func, save_name, code, ckpt_data.get("replicate")
+                    )
+
+                coordinated_func = ChiveLazyFunc(coordinated)
+                coordinated_func.name = None
+                coordinated_func.reload = reload
+                self.instances[save_name] = coordinated_func
+                return coordinated_func
+
+            fixturedef.func = decorator.decorator(wrapper, fixturedef.func)
+        elif hasattr(fixturedef.func, "_chive_node") and self.profiler is not None:
+            # Plain nodes only need their instance key for reporting
+            key = checkpoint_key(fixturedef.argname, get_save_params(request))
+
+            def wrapper(func, *args, **kwargs):
+                lazy_func = func(*args, **kwargs)
+                lazy_func.key = key
                 return lazy_func
 
             fixturedef._chive_old_func = fixturedef.func
@@ -139,12 +719,34 @@ class ChivePlugin:
 
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_setup(self, item):
+        if item.nodeid in self.fingerprints:
+            record = self.outcomes.cached(item.nodeid, self.fingerprints[item.nodeid])
+            if record is not None:
+                pytest.skip(f"chive: inputs unchanged since it {record['outcome']}")
+            self.item_outcomes[item.nodeid] = "passed"
+        if self.prefetcher is not None:
+            self.prefetcher.advance(item.nodeid)
         yield
         # Resolve any lazy functions that will actually get used
         for name, val in item.funcargs.items():
             if name in item._fixtureinfo.argnames and isinstance(val, ChiveLazyFunc):
                 v = val()
                 item.funcargs[name] = v
+        self.memory.use(item)
+
+    def pytest_runtest_logreport(self, report):
+        outcome = self.item_outcomes.get(report.nodeid)
+        if outcome is None or outcome == "failed":
+            return
+        if report.failed:
+            self.item_outcomes[report.nodeid] = "failed"
+        elif report.skipped:
+            self.item_outcomes[report.nodeid] = "skipped"
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_teardown(self, item, nextitem):
+        yield
+        self.memory.release(item)
 
     def pytest_fixture_post_finalizer(self, fixturedef, request):
         if hasattr(fixturedef, "_chive_old_func"):
@@ -157,11 +759,84 @@ class ChivePlugin:
                 and not isinstance(fixturedef.cached_result, ChiveLazyFunc)
             ):
                 save_path = get_save_path(request)
-                save_name = f"{save_path}/{fixturedef.argname}.pkl"
+                save_name = f"{save_path}/{fixturedef.argname}"
                 cached_val = request.getfixturevalue(fixturedef.argname)
                 self.IO.save(cached_val, save_name)
 
     # Internal functions
+    def _coordinate(
+        self,
+        lazy_func: ChiveLazyFunc,
+        save_name: str,
+        code: str,
+        replicates: Optional[int] = None,
+    ):
+        lease = self.locks.acquire(
+            save_name,
+            ready=lambda: self.IO.find_current(save_name, code, replicates) is not None,
+        )
+        if lease is None:
+            return self.IO.load(save_name)
+        save = lazy_func.save_callback
+        if save is None:
+            # Streams, replicates and out-of-process nodes are committed by the time
+            # they are computed
+            try:
+                return lazy_func()
+            finally:
+                self.locks.release(lease)
+        # Hold the lease until the checkpoint is committed, not just computed
+        lazy_func.save_callback = lambda val: save(
+            val, on_done=lambda: self.locks.release(lease)
+        )
+        try:
+            return lazy_func()
+        except BaseException:
+            self.locks.release(lease)
+            raise
+
+    def _pinned_params(self, fixturedef, request) -> Dict[str, Any]:
+        """Parameters a checkpoint pins, with their values, for the current test."""
+        pin = self.checkpoint_parameter_overrides.get(fixturedef.argname, {}).get("pin")
+        if not pin:
+            return {}
+        params = get_save_params(request, filter_dependencies=False)
+        pinned = {name: value for name, value in pin.items() if name in params}
+        indirect = set(pinned) - set(fixturedef.argnames)
+        if indirect:
+            raise ValueError(
+                f"Checkpoint {fixturedef.argname} can only pin parameters it takes as "
+                f"arguments, not {sorted(indirect)}"
+            )
+        return pinned
+
+    def _process_pool(self) -> Optional[Executor]:
+        if self.process_workers == 0:
+            return None
+        with self._process_lock:
+            if self.process_executor is None:
+                self.process_executor = process_pool(self.process_workers)
+            return self.process_executor
+
+    def _collect_garbage(self, config, session):
+        index = self.index or ChiveIndex()
+        try:
+            removed = index.gc(self.IO, parse_size(config.getoption("--chive-gc")))
+            kept = index.entries()
+        finally:
+            if index is not self.index:
+                index.close()
+        tw = config.get_terminal_writer()
+        if config.getoption("verbose") > 0:
+            for entry in removed:
+                tw.line(f"removed {entry.save_name} ({format_size(entry.size)})")
+        tw.line(
+            f"chive gc: removed {len(removed)} checkpoints "
+            f"({format_size(sum(e.size for e in removed))}), kept {len(kept)} "
+            f"({format_size(sum(e.size for e in kept))})"
+        )
+        return pytest.ExitCode.OK
+
     def _load_workflows(self):
         if self.manager is None:
             raise ChiveInternalError("Manager not loaded")
@@ -172,3 +847,30 @@ class ChivePlugin:
     def _load_param(self, name, param, overwrite):
         if overwrite or name not in self.params and not overwrite:
             self.params[name] = param.vals
+
+    def _load_checkpoint_overrides(self, name: str, vals: Mapping[str, Any]):
+        unknown = set(vals) - {"ignore", "pin"}
+        if unknown:
+            raise ValueError(
+                f"Unknown overrides {sorted(unknown)} for checkpoint {name}; "
+                "expected ignore (a list of parameters) and/or pin (a mapping)"
+            )
+        overrides = self.checkpoint_parameter_overrides[name]
+        if "ignore" in vals:
+            ignore = vals["ignore"]
+            ignore = [ignore] if isinstance(ignore, str) else list(ignore)
+            overrides["ignore"] = sorted({*overrides.get("ignore", ()), *ignore})
+        if "pin" in vals:
+            overrides["pin"] = {**overrides.get("pin", {}), **vals["pin"]}
+
+    def _load_sweep(self, name, sweep, overwrite):
+        if overwrite or name not in self.sweeps:
+            for other_name, other in self.sweeps.items():
+                shared = set(sweep.names) & set(other.names)
+                if other_name != name and shared:
+                    raise ValueError(
+                        f"Sweeps {other_name} and {name} both set {sorted(shared)}"
+                    )
+            self.sweeps[name] = sweep
+            # Expand now rather than separately for every test that uses it
+            sweep.table
@@ -0,0 +1,111 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+import threading
+from typing import *
+
+from .io import ChiveIO, _disk_size
+from .utils import estimate_size
+
+
+class ChivePrefetcher:
+    """
+    Loads the checkpoints that the next depth tests will load, on background threads,
+    into a staging area, so that reading and deserializing them is off the critical
+    path. Staging stops once the values waiting there add up to max_bytes, counting
+    loads still in progress by the size of their files, and each value is handed over
+    once, to the first load of its checkpoint.
+    """
+
+    def __init__(
+        self, io: ChiveIO, depth: int, max_bytes: int = 2**30, workers: int = 4
+    ):
+        self.io = io
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="chive-prefetch"
+        )
+        # Checkpoints each test loads, in run order
+        self.schedule: List[List[str]] = []
+        self.positions: Dict[str, int] = {}
+        # Position of the last test that loads each checkpoint
+        self.last_use: Dict[str, int] = {}
+        self.staged: Dict[str, Future] = {}
+        # Bytes reserved for each staged value: its file size until it is loaded
+        self.sizes: Dict[str, int] = {}
+        # Checkpoints already staged once; later loads of them (after eviction) are
+        # left to the tests themselves
+        self.seen: Set[str] = set()
+        self.next = 0
+        # Reentrant, since a load that is already done runs its callback in _submit
+        self._lock = threading.RLock()
+
+    def plan(self, items: Iterable[Tuple[str, List[str]]]):
+        """Set the checkpoints each test loads, as (nodeid, save names) in run order."""
+        for position, (nodeid, save_names) in enumerate(items):
+            self.schedule.append(save_names)
+            self.positions[nodeid] = position
+            for save_name in save_names:
+                self.last_use[save_name] = position
+
+    def advance(self, nodeid: str):
+        """
+        Called as a test starts: stage the checkpoints of the tests up to depth after
+        it, and drop any staged values no test from here on will load.
+        """
+        position = self.positions.get(nodeid)
+        if position is None:
+            return
+        with self._lock:
+            for save_name in list(self.staged):
+                if self.last_use[save_name] < position:
+                    self.staged.pop(save_name).cancel()
+                    self.sizes.pop(save_name, None)
+            self.next = max(self.next, position)
+            while self.next < min(position + self.depth + 1, len(self.schedule)):
+                for save_name in self.schedule[self.next]:
+                    if save_name in self.seen:
+                        continue
+                    if sum(self.sizes.values()) >= self.max_bytes:
+                        # Carry on from this checkpoint once staged values are taken
+                        return
+                    self.seen.add(save_name)
+                    self.staged[save_name] = self._submit(save_name)
+                self.next += 1
+
+    def _submit(self, save_name: str) -> Future:
+        found = self.io.find(save_name)
+        self.sizes[save_name] = _disk_size(found[1]) if found else 0
+        future = self.executor.submit(self.io.load, save_name)
+
+        def on_done(future: Future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            with self._lock:
+                if self.staged.get(save_name) is future:
+                    self.sizes[save_name] = estimate_size(future.result())
+
+        future.add_done_callback(on_done)
+        return future
+
+    def take(self, save_name: str | Path) -> Tuple[bool, Any]:
+        """
+        Hand over the staged value of a checkpoint, waiting for it if it is still
+        being loaded. Returns (False, None) if it wasn't staged or failed to load, in
+        which case the caller should load it itself.
+        """
+        with self._lock:
+            future = self.staged.pop(str(save_name), None)
+            self.sizes.pop(str(save_name), None)
+        if future is None or future.cancel():
+            return False, None
+        try:
+            return True, future.result()
+        except Exception:
+            # Let the caller's own load raise it
+            return False, None
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.staged.clear()
+        self.sizes.clear()
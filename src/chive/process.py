@@ -0,0 +1,84 @@
+from concurrent.futures import Executor
+from pathlib import Path
+import sys
+import time
+from typing import *
+
+from .io import BufferedPickleFormat, ChiveIO, PickleFormat
+from .lazy import _call_by_reference
+
+
+def process_pool(max_workers: int) -> Executor:
+    """
+    Pool of worker processes for nodes and figures. Workers are started from a fork
+    server rather than forked from the session, whose threads (writers, prefetchers,
+    lease heartbeats) may hold locks at the time, and look up what they run by module
+    and name on the session's current sys.path.
+    """
+    # From the submodule itself: the package caches the class from its first import,
+    # which can be stale if the module has been reloaded
+    from concurrent.futures.process import ProcessPoolExecutor
+    import multiprocessing
+
+    methods = multiprocessing.get_all_start_methods()
+    method = "forkserver" if "forkserver" in methods else "spawn"
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context(method),
+        initializer=_set_sys_path,
+        initargs=(list(sys.path),),
+    )
+
+
+def _set_sys_path(path: List[str]):
+    # The fork server keeps the sys.path it was started with, which may since have
+    # changed, e.g. when pytest inserted the rootdir of the workflow
+    sys.path[:] = path
+
+
+def _compute_and_write(
+    module: str, qualname: str, args, kwargs, save_name: str, compress: Optional[str]
+) -> float:
+    """
+    Worker side of run_in_process: compute a node and write its checkpoint, returning
+    how long the computation took. Only the timing goes back through the pipe.
+    """
+    start = time.perf_counter()
+    value = _call_by_reference(module, qualname, args, kwargs)
+    compute_time = time.perf_counter() - start
+    io = ChiveIO()
+    formats = io.formats
+    if not compress:
+        # Write anything that would be pickled with its buffers out of band instead,
+        # so the parent can map them rather than read them
+        formats = [f for f in formats if not isinstance(f, PickleFormat)]
+    io._write(value, save_name, compress, formats)
+    return compute_time
+
+
+def run_in_process(
+    executor: Executor,
+    io: ChiveIO,
+    func: Callable,
+    args: Sequence,
+    kwargs: Mapping[str, Any],
+    save_name: str | Path,
+    manifest: Optional[dict] = None,
+    compress: Optional[str] = None,
+):
+    """
+    Compute a checkpointed node in one of executor's worker processes, which writes
+    the checkpoint itself, and load the result from there.
+    """
+    future = executor.submit(
+        _compute_and_write,
+        func.__module__,
+        func.__qualname__,
+        args,
+        kwargs,
+        str(save_name),
+        compress,
+    )
+    compute_time = future.result()
+    io.adopt(save_name, {**(manifest or {}), "compute_time": compute_time}, compress)
+    return io.load(save_name)
@@ -0,0 +1,175 @@
+import contextlib
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import *
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _max_rss() -> Optional[int]:
+    """Peak resident set size of this process so far, in bytes."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in KiB on Linux but in bytes on macOS
+    return rss if os.uname().sysname == "Darwin" else rss * 1024
+
+
+def split_save_name(save_name: str | Path) -> Tuple[str, str]:
+    """(node name, key) of a checkpoint saved at .chive/<node>/<key>/<node>."""
+    save_name = Path(save_name)
+    return save_name.name, save_name.parent.name
+
+
+class ChiveProfiler:
+    """
+    Records how long every node instance spends being computed, loaded and saved, and
+    summarizes it per node. Reports can be written as a Chrome trace (the "traceEvents"
+    key, viewable in chrome://tracing or Perfetto) with the per-node summary alongside.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.events: List[dict] = []
+        self.statuses: Dict[Tuple[str, Optional[str]], str] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, phase: str, name: str, key: Optional[str]):
+        info: dict = {}
+        rss = _max_rss() if phase == "compute" else None
+        start = time.perf_counter()
+        try:
+            yield info
+        except BaseException as e:
+            info["error"] = type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter()
+            if rss is not None:
+                info["peak_memory_delta"] = _max_rss() - rss
+            event = {
+                "phase": phase,
+                "name": name,
+                "key": key,
+                "start": start - self.start,
+                "duration": end - start,
+                "thread": threading.get_ident(),
+                **info,
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def compute(self, lazy_func) -> ContextManager[dict]:
+        return self.span("compute", lazy_func.name, lazy_func.key)
+
+    def io(self, op: str, save_name: str) -> ContextManager[dict]:
+        return self.span(op, *split_save_name(save_name))
+
+    def mark(self, name: str, key: Optional[str], status: str):
+        """Record whether a checkpoint was a cache hit, a miss, or forcibly recomputed."""
+        with self._lock:
+            self.statuses[(name, key)] = status
+
+    def summary(self) -> List[dict]:
+        with self._lock:
+            events = list(self.events)
+            statuses = dict(self.statuses)
+        # Checkpoints that were hit but never needed still get a row
+        nodes = {
+            (name, key): self._empty_summary(name, key, status)
+            for (name, key), status in statuses.items()
+        }
+        for event in events:
+            name, key = event["name"], event["key"]
+            if (name, key) not in nodes:
+                nodes[(name, key)] = self._empty_summary(name, key, "node")
+            node = nodes[(name, key)]
+            node[f"{event['phase']}_time"] += event["duration"]
+            if event["phase"] in ("load", "fetch"):
+                node["bytes_read"] += event.get("bytes", 0)
+            elif event["phase"] == "save":
+                node["bytes_written"] += event.get("bytes", 0)
+            node["peak_memory_delta"] += event.get("peak_memory_delta", 0)
+            node["errors"] += "error" in event
+        for node in nodes.values():
+            node["total_time"] = (
+                node["compute_time"]
+                + node["load_time"]
+                + node["save_time"]
+                + node["fetch_time"]
+            )
+        return sorted(nodes.values(), key=lambda node: -node["total_time"])
+
+    @staticmethod
+    def _empty_summary(name: str, key: Optional[str], status: str) -> dict:
+        return {
+            "name": name,
+            "key": key,
+            "status": status,
+            "compute_time": 0.0,
+            "load_time": 0.0,
+            "save_time": 0.0,
+            "fetch_time": 0.0,
+            "bytes_read": 0,
+            "bytes_written": 0,
+            "peak_memory_delta": 0,
+            "errors": 0,
+        }
+
+    def trace_events(self) -> List[dict]:
+        pid = os.getpid()
+        return [
+            {
+                "name": f"{event['phase']} {event['name']}",
+                "cat": event["phase"],
+                "ph": "X",
+                "ts": event["start"] * 1e6,
+                "dur": event["duration"] * 1e6,
+                "pid": pid,
+                "tid": event["thread"],
+                "args": {
+                    k: v
+                    for k, v in event.items()
+                    if k not in ("phase", "name", "start", "duration", "thread")
+                },
+            }
+            for event in self.events
+        ]
+
+    def write(self, path: str | Path):
+        report = {
+            "traceEvents": self.trace_events(),
+            "displayTimeUnit": "ms",
+            "nodes": self.summary(),
+        }
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+
+    def terminal_summary(self, terminalreporter, limit: int = 10):
+        nodes = self.summary()
+        terminalreporter.section("chive slowest nodes")
+        if not nodes:
+            terminalreporter.line("no nodes were computed, loaded or saved")
+            return
+        counts: Dict[str, int] = {}
+        for node in nodes:
+            counts[node["status"]] = counts.get(node["status"], 0) + 1
+        terminalreporter.line(
+            ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+        )
+        for node in nodes[:limit]:
+            label = node["name"] if node["key"] is None else f"{node['name']}[{node['key']}]"
+            terminalreporter.line(
+                f"{node['total_time']:8.2f}s {node['status']:<9} {label} "
+                f"(compute {node['compute_time']:.2f}s, load {node['load_time']:.2f}s, "
+                f"save {node['save_time']:.2f}s, read {node['bytes_read']}B, "
+                f"written {node['bytes_written']}B)"
+            )
@@ -0,0 +1,179 @@
+import os
+from pathlib import Path
+import shutil
+from typing import *
+from urllib.parse import quote, urlparse
+import warnings
+
+from .io import _tmp_path
+
+
+class ChiveStore:
+    """
+    A shared store behind the local checkpoint directory, which checkpoints are
+    uploaded to once saved and downloaded from when missing locally. Keys are
+    /-separated paths relative to the checkpoint directory, e.g. "node/<key>/node.pkl".
+
+    ChiveIO goes through try_get and try_put, which treat the store as gone for the
+    rest of the session once it can't be reached, so that checkpoints are only read
+    from and written to the local directory.
+    """
+
+    # Errors from get and put that mean the store can't be reached, rather than that
+    # it doesn't have a key
+    unavailable_errors: Tuple[Type[BaseException], ...] = (OSError,)
+    available = True
+
+    def get(self, key: str, path: Path) -> bool:
+        """Download key into path; returns False if the store doesn't have it."""
+        raise NotImplementedError
+
+    def put(self, key: str, path: Path):
+        """Upload the file at path as key, replacing any existing object."""
+        raise NotImplementedError
+
+    def try_get(self, key: str, path: Path) -> bool:
+        """Like get, but returns False if the store can't be reached."""
+        if not self.available:
+            return False
+        try:
+            return self.get(key, path)
+        except self.unavailable_errors as e:
+            self._unavailable(e)
+            return False
+
+    def try_put(self, key: str, path: Path) -> bool:
+        """Like put, but returns False if the store can't be reached."""
+        if not self.available:
+            return False
+        try:
+            self.put(key, path)
+        except self.unavailable_errors as e:
+            self._unavailable(e)
+            return False
+        return True
+
+    def _unavailable(self, error: BaseException):
+        if self.available:
+            self.available = False
+            warnings.warn(
+                f"Checkpoint store {self} is unavailable, using local checkpoints "
+                f"only: {type(error).__name__}: {error}",
+                RuntimeWarning,
+            )
+
+
+class DirectoryStore(ChiveStore):
+    """A store in a directory, e.g. on a filesystem shared by the team."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def __str__(self):
+        return str(self.root)
+
+    def get(self, key: str, path: Path) -> bool:
+        try:
+            shutil.copyfile(self.root / key, path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def put(self, key: str, path: Path):
+        dest = self.root / key
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = _tmp_path(dest)
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, dest)
+
+
+class HTTPStore(ChiveStore):
+    """
+    An object store that serves GET and accepts PUT of objects at <url>/<key>, such as
+    a WebDAV server or an S3-compatible bucket that allows unsigned requests.
+    """
+
+    def __init__(self, url: str, timeout: float = 60.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def __str__(self):
+        return self.url
+
+    def _url(self, key: str) -> str:
+        return f"{self.url}/{quote(key)}"
+
+    def get(self, key: str, path: Path) -> bool:
+        import urllib.error
+        import urllib.request
+
+        try:
+            response = urllib.request.urlopen(self._url(key), timeout=self.timeout)
+            with response, open(path, "wb") as f:
+                shutil.copyfileobj(response, f)
+        except urllib.error.HTTPError as e:
+            if e.code in (403, 404):
+                return False
+            raise
+        return True
+
+    def put(self, key: str, path: Path):
+        import urllib.request
+
+        with open(path, "rb") as f:
+            request = urllib.request.Request(
+                self._url(key),
+                data=f,
+                method="PUT",
+                headers={"Content-Length": str(os.fstat(f.fileno()).st_size)},
+            )
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+
+
+class S3Store(ChiveStore):
+    """A store under a prefix of an S3 (or S3-compatible) bucket. Requires boto3."""
+
+    def __init__(self, bucket: str, prefix: str = "", **client_kwargs):
+        import boto3
+        from botocore.exceptions import BotoCoreError, ClientError
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", **client_kwargs)
+        # Besides connection errors, e.g. denied access or a missing bucket
+        self.unavailable_errors = (OSError, BotoCoreError, ClientError)
+
+    def __str__(self):
+        return f"s3://{self.bucket}/{self.prefix}"
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def get(self, key: str, path: Path) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.download_file(self.bucket, self._key(key), str(path))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            raise
+        return True
+
+    def put(self, key: str, path: Path):
+        self.client.upload_file(str(path), self.bucket, self._key(key))
+
+
+def open_store(url: str) -> ChiveStore:
+    """A store for an http(s)://, s3://bucket/prefix or file:// URL, or a directory."""
+    parsed = urlparse(url)
+    if parsed.scheme in ("http", "https"):
+        return HTTPStore(url)
+    if parsed.scheme == "s3":
+        return S3Store(parsed.netloc, parsed.path)
+    if parsed.scheme == "file":
+        return DirectoryStore(parsed.path)
+    if parsed.scheme and len(parsed.scheme) > 1:
+        raise ValueError(f"Unsupported checkpoint store URL {url!r}")
+    return DirectoryStore(url)
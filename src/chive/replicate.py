@@ -0,0 +1,72 @@
+from concurrent.futures import Executor, as_completed
+import threading
+from typing import *
+
+from .lazy import _call_by_reference
+
+_replicate = threading.local()
+
+
+def current_replicate() -> Optional[int]:
+    """
+    Index (0 to N - 1) of the replicate of a checkpoint(replicate=N) node being
+    computed, e.g. to seed its random number generator; None outside of one.
+    """
+    return getattr(_replicate, "index", None)
+
+
+def _call_replicate(index: int, func: Callable, args, kwargs):
+    previous = current_replicate()
+    _replicate.index = index
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _replicate.index = previous
+
+
+def _call_replicate_by_reference(index: int, module: str, qualname: str, args, kwargs):
+    return _call_replicate(
+        index, _call_by_reference, (module, qualname, args, kwargs), {}
+    )
+
+
+def run_replicates(
+    func: Callable,
+    indices: Sequence[int],
+    args: Sequence,
+    kwargs: Mapping[str, Any],
+    executor: Optional[Executor] = None,
+) -> Iterator[Tuple[int, Any]]:
+    """
+    Compute the given replicates of func, in executor's worker processes if there is
+    one, yielding (index, value) pairs as they finish. A failed replicate doesn't stop
+    the others; the first error is raised once they are all done.
+    """
+    error = None
+    if executor is None or len(indices) < 2 or "<locals>" in func.__qualname__:
+        for index in indices:
+            try:
+                value = _call_replicate(index, func, args, kwargs)
+            except Exception as e:
+                error = error or e
+                continue
+            yield index, value
+    else:
+        futures = {
+            executor.submit(
+                _call_replicate_by_reference,
+                index,
+                func.__module__,
+                func.__qualname__,
+                args,
+                kwargs,
+            ): index
+            for index in indices
+        }
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            yield futures[future], future.result()
+    if error is not None:
+        raise error
@@ -0,0 +1,54 @@
+import threading
+from typing import *
+
+_resume = threading.local()
+
+
+class ChiveStream:
+    """
+    The value of a streaming node, i.e. one defined as a generator function. Iterating
+    it yields the node's chunks one at a time, so the full result is never held in
+    memory, and it can be iterated any number of times. A checkpointed stream reads
+    its chunks back from disk; a plain streaming node runs its generator again.
+    """
+
+    def __init__(self, chunks: Callable[[], Iterator], length: Optional[int] = None):
+        self._chunks = chunks
+        # Number of chunks, if known without producing them
+        self.length = length
+
+    def __iter__(self) -> Iterator:
+        return iter(self._chunks())
+
+    def __repr__(self):
+        length = "?" if self.length is None else self.length
+        return f"<ChiveStream of {length} chunks>"
+
+
+def resumed_chunks() -> int:
+    """
+    Number of chunks an interrupted run of the streaming checkpoint currently being
+    computed already saved. A generator that calls this before its first yield must
+    then yield only the chunks after those; one that doesn't is run from the start,
+    and its first chunks are discarded instead of being saved again.
+    """
+    state = getattr(_resume, "state", None)
+    if state is None:
+        return 0
+    state["acknowledged"] = True
+    return state["done"]
+
+
+class _resuming:
+    """Makes resumed_chunks() report done while a stream's generator runs."""
+
+    def __init__(self, done: int):
+        self.state = {"done": done, "acknowledged": False}
+
+    def __enter__(self):
+        self.previous = getattr(_resume, "state", None)
+        _resume.state = self.state
+        return self.state
+
+    def __exit__(self, *exc):
+        _resume.state = self.previous
@@ -0,0 +1,167 @@
+import inspect
+import itertools
+import math
+import random
+from typing import *
+
+from .nodes import param
+
+__all__ = ["sweep", "zipped"]
+
+
+class zipped:
+    """Parameters that vary together: the i-th values of each are used together."""
+
+    def __init__(self, **params: Sequence):
+        lengths = {name: len(vals) for name, vals in params.items()}
+        if len(set(lengths.values())) > 1:
+            raise ValueError(f"zipped parameters need equal lengths, got {lengths}")
+        self.names: Tuple[str, ...] = tuple(params)
+        self.rows: List[tuple] = list(zip(*params.values()))
+
+
+def _predicate(where) -> Optional[Callable[[Dict[str, Any]], bool]]:
+    """Turn a callable or an expression string into a test on a {name: value} row."""
+    if where is None:
+        return None
+    if isinstance(where, str):
+        code = compile(where, "<sweep where>", "eval")
+        return lambda row: bool(eval(code, {}, dict(row)))
+    parameters = inspect.signature(where).parameters.values()
+    if any(p.kind == p.VAR_KEYWORD for p in parameters):
+        return lambda row: bool(where(**row))
+    wanted = [p.name for p in parameters]
+    return lambda row: bool(where(**{k: row[k] for k in wanted if k in row}))
+
+
+class sweep:
+    """
+    Several parameters swept jointly, rather than as independent params that pytest
+    multiplies out into their full Cartesian product.
+
+    Keyword arguments are product axes and zipped groups vary together. where (a
+    callable taking any of the parameter names as arguments, or an expression over
+    them) excludes combinations, and sample keeps at most that many of the remaining
+    ones, drawn at random or by Latin hypercube sampling (method="lhs"), which covers
+    every axis evenly. The combinations are expanded once into table and never
+    enumerated in full when sampling.
+    """
+
+    def __init__(
+        self,
+        *groups: zipped,
+        where: Optional[str | Callable[..., bool]] = None,
+        sample: Optional[int] = None,
+        method: Literal["random", "lhs"] = "random",
+        seed: int = 0,
+        **params: Sequence | param,
+    ):
+        if method not in ("random", "lhs"):
+            raise ValueError(f"Unknown sweep sampling method {method!r}")
+        self.axes: List[Tuple[Tuple[str, ...], List[tuple]]] = [
+            (group.names, group.rows) for group in groups
+        ]
+        for name, vals in params.items():
+            if isinstance(vals, param):
+                vals = vals.vals
+            self.axes.append(((name,), [(v,) for v in vals]))
+        self.names: Tuple[str, ...] = tuple(
+            name for names, _ in self.axes for name in names
+        )
+        if len(set(self.names)) != len(self.names):
+            raise ValueError(f"Parameters appear more than once in sweep {self.names}")
+        self.where = _predicate(where)
+        self.sample = sample
+        self.method = method
+        self.seed = seed
+        self._table: Optional[List[tuple]] = None
+
+    @classmethod
+    def from_config(cls, spec: Mapping[str, Any]) -> "sweep":
+        """
+        Build a sweep from a config entry with "product" and/or "zip" mappings (or a
+        list of "zip" mappings) and optional "where", "sample", "method" and "seed".
+        """
+        zips = spec.get("zip") or []
+        if isinstance(zips, Mapping):
+            zips = [zips]
+        return cls(
+            *(zipped(**group) for group in zips),
+            where=spec.get("where"),
+            sample=spec.get("sample"),
+            method=spec.get("method", "random"),
+            seed=spec.get("seed", 0),
+            **spec.get("product", {}),
+        )
+
+    @property
+    def size(self) -> int:
+        """Number of combinations before where and sampling are applied."""
+        return math.prod(len(rows) for _, rows in self.axes)
+
+    @property
+    def table(self) -> List[tuple]:
+        """The combinations to run, as tuples of values in the order of names."""
+        if self._table is None:
+            self._table = [self._row(indices) for indices in self._expand()]
+        return self._table
+
+    def _row(self, indices: Sequence[int]) -> tuple:
+        return tuple(
+            value for (_, rows), i in zip(self.axes, indices) for value in rows[i]
+        )
+
+    def _accept(self, indices: Sequence[int]) -> bool:
+        if self.where is None:
+            return True
+        return self.where(dict(zip(self.names, self._row(indices))))
+
+    def _decode(self, index: int) -> Tuple[int, ...]:
+        """Axis indices of the index-th combination of the full product."""
+        indices = []
+        for _, rows in reversed(self.axes):
+            index, i = divmod(index, len(rows))
+            indices.append(i)
+        return tuple(reversed(indices))
+
+    def _expand(self) -> List[Tuple[int, ...]]:
+        size = self.size
+        if self.sample is None or self.sample >= size:
+            everything = itertools.product(*(range(len(rows)) for _, rows in self.axes))
+            return [indices for indices in everything if self._accept(indices)]
+        if self.method == "lhs":
+            return self._latin_hypercube()
+        return self._random()
+
+    def _random(self) -> List[Tuple[int, ...]]:
+        rng = random.Random(self.seed)
+        size = self.size
+        seen: Set[int] = set()
+        chosen = []
+        # Rejection sampling; give up eventually if where excludes nearly everything
+        for _ in range(100 * self.sample):
+            if len(chosen) == self.sample or len(seen) == size:
+                break
+            index = rng.randrange(size)
+            if index in seen:
+                continue
+            seen.add(index)
+            indices = self._decode(index)
+            if self._accept(indices):
+                chosen.append(indices)
+        return sorted(chosen)
+
+    def _latin_hypercube(self) -> List[Tuple[int, ...]]:
+        """
+        One sample per stratum of every axis, so each axis's values are covered as
+        evenly as sample allows. Combinations excluded by where are dropped, not
+        replaced, so fewer than sample may remain.
+        """
+        rng = random.Random(self.seed)
+        n = self.sample
+        columns = []
+        for _, rows in self.axes:
+            strata = rng.sample(range(n), n)
+            columns.append([int((s + rng.random()) * len(rows) / n) for s in strata])
+        unique = sorted(set(zip(*columns)))
+        return [indices for indices in unique if self._accept(indices)]
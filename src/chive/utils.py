@@ -1,3 +1,7 @@
+import re
+import sys
+
+
 class ChiveInternalError(Exception):
     """Exception raised for internal errors in the Chive plugin."""
 
@@ -11,3 +15,55 @@ class ChiveInternalError(Exception):
     def __str__(self):
         error_str = f"ChiveInternalError: {self.message}"
         return error_str
+
+
+class ChiveCachedFailure(Exception):
+    """
+    Raised instead of computing a checkpoint whose last computation, by the same code
+    and with the same parameters, failed.
+    """
+
+    def __init__(self, name: str, record: dict):
+        super().__init__(name, record)
+        self.name = name
+        self.record = record
+
+    def __str__(self):
+        return (
+            f"{self.name} failed when last computed with this code "
+            f"({self.record['error']}: {self.record['message']}); use "
+            f"--chive-retry-failures to compute it again. The original error was:\n\n"
+            f"{self.record['traceback']}"
+        )
+
+
+def estimate_size(obj) -> int:
+    """Rough in-memory size of a value, for budgeting rather than exact accounting."""
+    size = getattr(obj, "nbytes", None)
+    if isinstance(size, int):
+        return size
+    try:
+        return int(obj.memory_usage(deep=True).sum())
+    except Exception:
+        pass
+    return sys.getsizeof(obj)
+
+
+_SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parse_size(size: str) -> int:
+    """Parse a byte count such as 512M or 4G (binary units)."""
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMGT]?)i?B?\s*", size, re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Invalid size {size!r}, expected e.g. 512M or 4G")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def format_size(size: float) -> str:
+    """Human-readable byte count, e.g. 1.5MB (binary units, like parse_size)."""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
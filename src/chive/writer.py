@@ -0,0 +1,113 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+import threading
+from typing import *
+
+from .io import ChiveIO
+from .utils import estimate_size
+
+
+class ChiveWriter:
+    """
+    Session-scoped pool that serializes and writes checkpoints in the background,
+    streaming each value into a temporary file that is renamed into place once synced.
+
+    Submissions block once more than max_queued_bytes of values are waiting to be
+    written, so a fast producer can't hold an unbounded number of results in memory.
+    Failures are collected rather than raised and are reported by drain().
+
+    Values are written as they are at write time, so they must not be mutated after
+    being submitted. With no workers, values are saved as they are submitted instead.
+    """
+
+    def __init__(self, io: ChiveIO, workers: int = 0, max_queued_bytes: int = 2**30):
+        self.io = io
+        self.max_queued_bytes = max_queued_bytes
+        self.executor = (
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chive-writer")
+            if workers > 0
+            else None
+        )
+        self.queued_bytes = 0
+        self.pending: Dict[str, Future] = {}
+        self.errors: List[Tuple[str, BaseException]] = []
+        self._cond = threading.Condition()
+
+    def submit(
+        self,
+        obj,
+        save_name: str | Path,
+        manifest: Optional[dict] = None,
+        compress: Optional[str] = None,
+        on_done: Optional[Callable[[], None]] = None,
+    ):
+        """
+        Queue obj to be saved under save_name. on_done is called once the write has been
+        committed or has failed.
+        """
+        save_name = str(save_name)
+        if self.executor is None:
+            try:
+                self.io.save(obj, save_name, manifest=manifest, compress=compress)
+            finally:
+                if on_done is not None:
+                    on_done()
+            return
+
+        size = estimate_size(obj)
+        with self._cond:
+            # Always admit at least one write, even if it alone exceeds the budget
+            self._cond.wait_for(
+                lambda: self.queued_bytes == 0
+                or self.queued_bytes + size <= self.max_queued_bytes
+            )
+            self.queued_bytes += size
+
+        def write():
+            try:
+                self.io.save(obj, save_name, manifest=manifest, compress=compress)
+            except BaseException as e:
+                with self._cond:
+                    self.errors.append((save_name, e))
+                raise
+            finally:
+                with self._cond:
+                    self.queued_bytes -= size
+                    self._cond.notify_all()
+                if on_done is not None:
+                    on_done()
+
+        future = self.executor.submit(write)
+        with self._cond:
+            self.pending[save_name] = future
+        future.add_done_callback(lambda f: self._forget(save_name, f))
+
+    def _forget(self, save_name: str, future: Future):
+        with self._cond:
+            if self.pending.get(save_name) is future:
+                del self.pending[save_name]
+
+    def wait(self, save_name: str | Path):
+        """Block until any queued write to save_name has been committed."""
+        with self._cond:
+            future = self.pending.get(str(save_name))
+        if future is not None:
+            # Errors are reported through drain(), not to whoever happens to wait
+            future.exception()
+
+    def drain(self) -> List[Tuple[str, BaseException]]:
+        """Wait for all queued writes and return (and clear) any failures."""
+        while True:
+            with self._cond:
+                futures = [f for f in self.pending.values() if not f.done()]
+            if not futures:
+                break
+            for future in futures:
+                future.exception()
+        with self._cond:
+            errors, self.errors = self.errors, []
+        return errors
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
@@ -1 +1,158 @@
 pytest_plugins = 'pytester'
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+import threading
+from urllib.parse import unquote
+import pytest
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("chive benchmarks")
+    group.addoption(
+        "--benchmark",
+        action="store_true",
+        default=False,
+        help="run the chive overhead benchmarks (skipped otherwise)",
+    )
+    group.addoption(
+        "--benchmark-save",
+        metavar="PATH",
+        default=None,
+        help="write benchmark results to PATH as a JSON baseline",
+    )
+    group.addoption(
+        "--benchmark-compare",
+        metavar="PATH",
+        default=None,
+        help="fail benchmarks that regressed relative to the baseline at PATH",
+    )
+    group.addoption(
+        "--benchmark-tolerance",
+        type=float,
+        default=0.5,
+        help="allowed relative regression against the baseline (default 0.5 = 50%%)",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: chive overhead benchmark")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="benchmarks only run with --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+class BenchmarkResults:
+    """Benchmark measurements for the session, compared against an optional baseline."""
+
+    # Timings closer than this to their baseline are noise, whatever the ratio
+    min_difference = 1e-4
+
+    def __init__(self, baseline: dict, tolerance: float):
+        self.baseline = baseline
+        self.tolerance = tolerance
+        self.results: dict = {}
+
+    def record(self, name: str, value: float, higher_is_better: bool = False):
+        self.results[name] = {"value": value, "higher_is_better": higher_is_better}
+
+    def regressions(self, names) -> list:
+        regressions = []
+        for name in names:
+            if name not in self.baseline:
+                continue
+            value = self.results[name]["value"]
+            base = self.baseline[name]["value"]
+            if self.results[name]["higher_is_better"]:
+                regressed = value < base / (1 + self.tolerance)
+            else:
+                regressed = (
+                    value > base * (1 + self.tolerance)
+                    and value - base > self.min_difference
+                )
+            if regressed:
+                regressions.append(f"{name}: {value:.4g} (baseline {base:.4g})")
+        return regressions
+
+
+@pytest.fixture(scope="session")
+def benchmark_results(request):
+    compare = request.config.getoption("--benchmark-compare")
+    baseline = json.loads(Path(compare).read_text()) if compare else {}
+    results = BenchmarkResults(baseline, request.config.getoption("--benchmark-tolerance"))
+    yield results
+    save = request.config.getoption("--benchmark-save")
+    if save and results.results:
+        Path(save).write_text(json.dumps(results.results, indent=2, sort_keys=True))
+
+
+@pytest.fixture
+def chive_benchmark(benchmark_results):
+    """Record measurements for one benchmark; fails it if any regressed."""
+    before = set(benchmark_results.results)
+    yield benchmark_results
+    regressions = benchmark_results.regressions(set(benchmark_results.results) - before)
+    if regressions:
+        pytest.fail("Benchmark regressions:\n" + "\n".join(regressions))
+
+
+class FakeStoreHandler(BaseHTTPRequestHandler):
+    """Serves GET and PUT of objects kept in the server's objects dict."""
+
+    def do_GET(self):
+        data = self.server.objects.get(unquote(self.path.lstrip("/")))
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        length = int(self.headers["Content-Length"])
+        self.server.objects[unquote(self.path.lstrip("/"))] = self.rfile.read(length)
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def fake_store():
+    """An in-process HTTP object store; its URL is at .url, its contents in .objects."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeStoreHandler)
+    server.objects = {}
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def workflow(pytester):
+    """Set up pytester for a workflow module wf.py; call with its source."""
+    pytester.makeini(
+        """
+        [pytest]
+        workflows = wf
+        python_files = wf.py
+        """
+    )
+    pytester.syspathinsert()
+
+    def make(source: str):
+        pytester.makepyfile(wf=source)
+        return pytester
+
+    return make
@@ -0,0 +1,197 @@
+"""
+Overhead benchmarks for the chive plugin on synthetic workflows.
+
+Run with ``pytest tests/test_benchmarks.py --benchmark``. Results can be stored with
+``--benchmark-save=baseline.json`` and later checked against with
+``--benchmark-compare=baseline.json``.
+"""
+
+import cProfile
+import pstats
+import time
+import pytest
+
+pytestmark = pytest.mark.benchmark
+
+HOOKS = ["pytest_generate_tests", "pytest_fixture_setup", "pytest_runtest_setup"]
+
+
+def wide_workflow(width: int) -> str:
+    """One parametrized root feeding width independent nodes, joined by one node."""
+    nodes = "\n".join(
+        f"@node\ndef n{i}(root):\n    return root + {i}\n" for i in range(width)
+    )
+    args = ", ".join(f"n{i}" for i in range(width))
+    return f"""
+from chive import *
+
+dataset = param(*range(4))
+
+@node
+def root(dataset):
+    return dataset
+
+{nodes}
+
+@node
+def joined({args}):
+    return sum([{args}])
+
+@output
+def test_out(joined):
+    pass
+"""
+
+
+def deep_workflow(depth: int) -> str:
+    """A chain of depth nodes below one parametrized root."""
+    nodes = "\n".join(
+        f"@node\ndef n{i}(n{i - 1}):\n    return n{i - 1} + 1\n" for i in range(1, depth)
+    )
+    return f"""
+from chive import *
+
+dataset = param(*range(4))
+
+@node
+def n0(dataset):
+    return dataset
+
+{nodes}
+
+@output
+def test_out(n{depth - 1}):
+    pass
+"""
+
+
+def grid_workflow(size: int) -> str:
+    """A size x size parameter grid through a checkpoint and a plain node."""
+    return f"""
+from chive import *
+
+alpha = param(*range({size}))
+beta = param(*range({size}))
+
+@checkpoint
+def data(alpha):
+    return alpha
+
+@node
+def result(data, beta):
+    return data * beta
+
+@output
+def test_out(result):
+    pass
+"""
+
+
+def checkpoint_workflow(count: int, size: int) -> str:
+    """count checkpoints of size bytes each."""
+    return f"""
+from chive import *
+
+index = param(*range({count}))
+
+@checkpoint
+def blob(index):
+    return bytes({size})
+
+@output
+def test_out(blob):
+    pass
+"""
+
+
+def best_of(n: int, func) -> float:
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def hook_times(pytester, *args, runs: int = 3) -> dict:
+    """Cumulative time spent inside each ChivePlugin hook, best of several runs."""
+    best = dict.fromkeys(HOOKS, float("inf"))
+    for _ in range(runs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            pytester.runpytest(*args)
+        finally:
+            profile.disable()
+        times = dict.fromkeys(HOOKS, 0.0)
+        for (filename, _, funcname), stat in pstats.Stats(profile).stats.items():
+            path = filename.replace("\\", "/")
+            if funcname in times and path.endswith("chive/plugin.py"):
+                times[funcname] += stat[3]
+        best = {hook: min(best[hook], times[hook]) for hook in HOOKS}
+    return best
+
+
+def measure(chive_benchmark, pytester, name: str, n_items: int):
+    collect = best_of(3, lambda: pytester.runpytest("--collect-only", "-q"))
+    chive_benchmark.record(f"{name}.collect", collect)
+    run = best_of(3, lambda: pytester.runpytest("-p", "no:cacheprovider"))
+    chive_benchmark.record(f"{name}.run", run)
+    for hook, seconds in hook_times(pytester, "-p", "no:cacheprovider").items():
+        chive_benchmark.record(f"{name}.{hook}_per_item", seconds / n_items)
+
+
+@pytest.mark.parametrize("width", [10, 50, 200])
+def test_wide_dag(workflow, chive_benchmark, width):
+    pytester = workflow(wide_workflow(width))
+    pytester.runpytest().assert_outcomes(passed=4)
+    measure(chive_benchmark, pytester, f"wide[{width}]", 4)
+
+
+@pytest.mark.parametrize("depth", [10, 50, 200])
+def test_deep_dag(workflow, chive_benchmark, depth):
+    pytester = workflow(deep_workflow(depth))
+    pytester.runpytest().assert_outcomes(passed=4)
+    measure(chive_benchmark, pytester, f"deep[{depth}]", 4)
+
+
+@pytest.mark.parametrize("size", [4, 16, 32])
+def test_parameter_grid(workflow, chive_benchmark, size):
+    pytester = workflow(grid_workflow(size))
+    pytester.runpytest().assert_outcomes(passed=size * size)
+    measure(chive_benchmark, pytester, f"grid[{size}]", size * size)
+
+
+@pytest.mark.parametrize("count", [10, 100])
+def test_checkpoint_throughput(workflow, chive_benchmark, count):
+    size = 2**20
+    pytester = workflow(checkpoint_workflow(count, size))
+
+    def run(*args):
+        start = time.perf_counter()
+        result = pytester.runpytest("-p", "no:cacheprovider", *args)
+        elapsed = time.perf_counter() - start
+        result.assert_outcomes(passed=count)
+        return elapsed
+
+    saving = run()
+    loading = run()
+    config = pytester.makefile(".yml", cfg="recompute: true")
+    recomputing = run("--chive_config", str(config))
+    megabytes = count * size / 2**20
+    chive_benchmark.record(f"checkpoints[{count}].save_MBps", megabytes / saving, True)
+    chive_benchmark.record(f"checkpoints[{count}].load_MBps", megabytes / loading, True)
+    chive_benchmark.record(f"checkpoints[{count}].recompute", recomputing)
+
+
+@pytest.mark.parametrize("compress", [None, "gzip", "lzma"])
+def test_io_throughput(tmp_path, chive_benchmark, compress):
+    from chive.io import ChiveIO
+
+    chive_io = ChiveIO()
+    obj = [bytes(range(256)) * 64 for _ in range(512)]
+    megabytes = sum(len(b) for b in obj) / 2**20
+    save = best_of(3, lambda: chive_io.save(obj, tmp_path / "node", compress=compress))
+    load = best_of(3, lambda: chive_io.load(tmp_path / "node"))
+    chive_benchmark.record(f"io[{compress}].save_MBps", megabytes / save, True)
+    chive_benchmark.record(f"io[{compress}].load_MBps", megabytes / load, True)
@@ -1,3 +1,5 @@
+import os
+from pathlib import Path
 import pytest
 import subprocess
 import time
@@ -16,6 +18,1144 @@ def test_import_chive():
     assert elapsed < 0.2
 
 
+def test_startup_budget(workflow):
+    """
+    Importing the plugin on top of pytest stays cheap and leaves heavy optional modules
+    alone, and collecting a thousand-test parameter grid stays well under a second
+    """
+    code = (
+        "import sys, time, pytest\n"
+        "start = time.perf_counter()\n"
+        "import chive.plugin\n"
+        "print(time.perf_counter() - start)\n"
+        "print(' '.join(sys.modules))\n"
+    )
+    result = subprocess.run(["python", "-c", code], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    elapsed, modules = result.stdout.splitlines()
+    assert float(elapsed) < 0.1
+    for heavy in ["yaml", "sqlite3", "multiprocessing", "matplotlib"]:
+        assert heavy not in modules.split()
+
+    pytester = workflow(
+        """
+        from chive import *
+
+        alpha = param(*range(40))
+        beta = param(*range(25))
+
+        @checkpoint
+        def data(alpha):
+            return alpha
+
+        @node
+        def result(data, beta):
+            return data * beta
+
+        @output
+        def test_out(result):
+            pass
+        """
+    )
+    result = pytester.runpytest("--collect-only", "-q")
+    result.stdout.fnmatch_lines(["1000 tests collected*"])
+    assert result.duration < 1.0
+
+
+def test_config_cache(tmp_path, monkeypatch):
+    import sys
+    from chive import config
+
+    path = tmp_path / "cfg.yml"
+    path.write_text("recompute: true\n")
+    cache = str(tmp_path / "configs.pkl")
+    monkeypatch.setattr(config, "_parsed", {})
+    assert config.load_config(str(path), cache) == {"recompute": True}
+
+    # A fresh process reads the cache without needing yaml at all
+    monkeypatch.setattr(config, "_parsed", {})
+    monkeypatch.setitem(sys.modules, "yaml", None)
+    assert config.load_config(str(path), cache) == {"recompute": True}
+
+    path.write_text("recompute: false\n")
+    os.utime(path, ns=(0, 0))
+    with pytest.raises(ImportError):
+        config.load_config(str(path), cache)
+
+
+def test_checkpoint_key_is_order_independent():
+    from chive.io import checkpoint_key
+
+    a = checkpoint_key("data", {"dataset": "a", "alpha": 0.1})
+    b = checkpoint_key("data", {"alpha": 0.1, "dataset": "a"})
+    assert a == b
+    assert a != checkpoint_key("other", {"dataset": "a", "alpha": 0.1})
+    assert a != checkpoint_key("data", {"dataset": "a", "alpha": 0.10000001})
+    assert checkpoint_key("data", {"x": 1}) != checkpoint_key("data", {"x": "1"})
+
+    # Functions are keyed by name; objects whose repr is just an address can't be
+    assert checkpoint_key("data", {"f": len}) == checkpoint_key("data", {"f": len})
+    with pytest.raises(TypeError, match="no stable encoding"):
+        checkpoint_key("data", {"x": object()})
+
+
+def test_checkpoint_key_hashes_array_contents():
+    np = pytest.importorskip("numpy")
+    from chive.io import checkpoint_key
+
+    a, b = np.zeros(10**5), np.zeros(10**5)
+    b[50000] = 1
+    assert checkpoint_key("data", {"x": a}) != checkpoint_key("data", {"x": b})
+    assert checkpoint_key("data", {"x": a}) == checkpoint_key("data", {"x": a.copy()})
+    objects = np.array(["a", 1], dtype=object)
+    assert checkpoint_key("data", {"x": objects}) == checkpoint_key(
+        "data", {"x": objects.copy()}
+    )
+
+    pd = pytest.importorskip("pandas")
+    df = pd.DataFrame({"a": a, "b": np.arange(10**5)})
+    changed = df.copy()
+    changed.loc[50000, "b"] = -1
+    assert checkpoint_key("data", {"x": df}) != checkpoint_key("data", {"x": changed})
+    assert checkpoint_key("data", {"x": df}) == checkpoint_key("data", {"x": df.copy()})
+    renamed = df.rename(columns={"b": "c"})
+    assert checkpoint_key("data", {"x": df}) != checkpoint_key("data", {"x": renamed})
+    assert checkpoint_key("data", {"x": df["b"]}) != checkpoint_key(
+        "data", {"x": changed["b"]}
+    )
+
+
+def test_checkpoint_manifest(workflow):
+    pytester = workflow(
+        """
+        from chive import *
+
+        dataset = param("a", "b")
+        exp_name = param("e1", "e2")
+
+        @checkpoint
+        def data(dataset):
+            return dataset * 3
+
+        @output
+        def test_out(data, exp_name):
+            assert data[0] * 3 == data
+        """
+    )
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=4)
+
+    import json
+
+    manifests = sorted(pytester.path.glob(".chive/data/*/manifest.json"))
+    assert len(manifests) == 2
+    params = sorted(json.loads(m.read_text())["params"]["dataset"] for m in manifests)
+    assert params == ["a", "b"]
+
+
+def test_register_format(tmp_path, monkeypatch):
+    from chive import io
+
+    monkeypatch.setattr(io, "FORMATS", list(io.FORMATS))
+
+    class Text(str):
+        pass
+
+    class TextFormat(io.ChiveFormat):
+        extension = ".txt"
+
+        def match(self, obj):
+            return isinstance(obj, Text)
+
+        def save(self, obj, path):
+            path.write_text(obj)
+
+        def load(self, path):
+            return Text(path.read_text())
+
+    io.register_format(TextFormat())
+    chive_io = io.ChiveIO()
+    chive_io.save({"a": 1}, tmp_path / "node")
+    assert chive_io.load(tmp_path / "node") == {"a": 1}
+    chive_io.save(Text("hello"), tmp_path / "node")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["node.txt"]
+    assert chive_io.load(tmp_path / "node") == "hello"
+
+
+def test_checkpoint_loaded_lazily(workflow):
+    pytester = workflow(
+        """
+        from chive import *
+
+        dataset = param("a")
+
+        @checkpoint
+        def raw(dataset):
+            return dataset * 3
+
+        @checkpoint
+        def data(raw):
+            return raw.upper()
+
+        @output
+        def test_out(data):
+            assert data == "AAA"
+        """
+    )
+    pytester.runpytest().assert_outcomes(passed=1)
+    result = pytester.runpytest("-s")
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(["*Loaded data from checkpoint*"])
+    result.stdout.no_fnmatch_line("*Loaded raw*")
+
+
+def test_edited_node_invalidates_checkpoint(workflow):
+    source = """
+        from chive import *
+
+        dataset = param("a")
+
+        @checkpoint
+        def raw(dataset):
+            return dataset * 3
+
+        @checkpoint
+        def data(raw):
+            return raw.upper()
+
+        @output
+        def test_out(data):
+            assert data in ("AAA", "AAA!")
+        """
+    pytester = workflow(source)
+    pytester.runpytest().assert_outcomes(passed=1)
+
+    # Comments and formatting are not code changes
+    pytester.makepyfile(wf=source.replace("raw.upper()", "raw.upper()  # shout"))
+    result = pytester.runpytest("-s")
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(["*Loaded data from checkpoint*"])
+
+    # Only the edited node and what is downstream of it are recomputed
+    pytester.makepyfile(wf=source.replace("raw.upper()", 'raw.upper() + "!"'))
+    result = pytester.runpytest("-s")
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(["*Loaded raw from checkpoint*"])
+    result.stdout.no_fnmatch_line("*Loaded data*")
+
+    # Editing an upstream node recomputes everything below it
+    edited = source.replace("raw.upper()", 'raw.upper() + "!"')
+    pytester.makepyfile(wf=edited.replace("dataset * 3", "dataset * 3 * 1"))
+    result = pytester.runpytest("-s")
+    result.assert_outcomes(passed=1)
+    result.stdout.no_fnmatch_line("*Loaded*")
+
+
+@pytest.mark.parametrize("compress", [None, "gzip", "bz2", "lzma"])
+def test_compressed_checkpoint_roundtrip(tmp_path, compress):
+    from chive.compression import MAGIC
+    from chive.io import ChiveIO
+
+    obj = {"values": list(range(1000))}
+    chive_io = ChiveIO()
+    chive_io.save(obj, tmp_path / "node", compress=compress)
+    assert (tmp_path / "node.pkl").read_bytes().startswith(MAGIC) == bool(compress)
+    assert chive_io.load(tmp_path / "node") == obj
+
+
+def test_numpy_checkpoint_is_writable_memmap(tmp_path):
+    np = pytest.importorskip("numpy")
+    from chive.io import ChiveIO
+
+    chive_io = ChiveIO()
+    chive_io.save(np.arange(10.0), tmp_path / "node")
+    data = chive_io.load(tmp_path / "node")
+    assert isinstance(data, np.memmap)
+    data -= data.mean()
+    assert data[0] == -4.5
+    # Changes stay in memory, not in the checkpoint
+    assert chive_io.load(tmp_path / "node")[0] == 0.0
+
+
+def test_numpy_subclasses_keep_their_type(tmp_path):
+    np = pytest.importorskip("numpy")
+    from chive.io import ChiveIO
+
+    chive_io = ChiveIO()
+    chive_io.save(np.matrix([[1, 2], [3, 4]]), tmp_path / "matrix")
+    m = chive_io.load(tmp_path / "matrix")
+    assert type(m) is np.matrix
+    assert (m * m).tolist() == [[7, 10], [15, 22]]
+
+    chive_io.save(np.rec.array([(1, 2.0)], names="a,b"), tmp_path / "rec")
+    assert chive_io.load(tmp_path / "rec").a.tolist() == [1]
+
+    # A loaded (memory-mapped) array is saved as an array again
+    chive_io.save(np.arange(3), tmp_path / "array")
+    chive_io.save(chive_io.load(tmp_path / "array"), tmp_path / "plain")
+    assert sorted(p.suffix for p in tmp_path.glob("plain.*")) == [".npy"]
+
+
+def test_concurrent_upstream_resolution(workflow):
+    pytester = workflow(
+        """
+        import threading
+        from chive import *
+
+        # Both upstream nodes must be running at the same time to get past this
+        barrier = threading.Barrier(2, timeout=5)
+        calls = []
+
+        @node
+        def left():
+            calls.append("left")
+            barrier.wait()
+            return 1
+
+        @node
+        def right():
+            calls.append("right")
+            barrier.wait()
+            return 2
+
+        @node
+        def both(left, right):
+            return left + right
+
+        @output
+        def test_out(both):
+            assert both == 3
+            assert sorted(calls) == ["left", "right"]
+        """
+    )
+    pytester.runpytest("--chive-workers", "2").assert_outcomes(passed=1)
+
+
+def test_locked_checkpoint_chain_with_one_worker(workflow):
+    pytester = workflow(
+        """
+        from chive import *
+
+        @node
+        def a():
+            return 1
+
+        @checkpoint
+        def b(a):
+            return a + 1
+
+        @checkpoint
+        def c(b):
+            return b + 1
+
+        @output
+        def test_out(c):
+            assert c == 3
+        """
+    )
+    # In a subprocess, so that a deadlock fails the test rather than hanging it
+    result = pytester.runpytest_subprocess(
+        "--chive-workers", "1", "--chive-lock", timeout=60
+    )
+    result.assert_outcomes(passed=1)
+
+
+def test_items_grouped_by_checkpoint(workflow):
+    pytester = workflow(
+        """
+        from chive import *
+
+        dataset = param("a", "b")
+        method = param("m1", "m2")
+        exp_name = param("e1", "e2")
+
+        @checkpoint
+        def data(dataset):
+            return dataset
+
+        @checkpoint
+        def result(data, method):
+            return data + method
+
+        @output
+        def test_x(result, exp_name):
+            pass
+
+        @output
+        def test_y(data, exp_name):
+            pass
+        """
+    )
+    result = pytester.runpytest("--collect-only", "-q")
+    ids = [line.split("[")[1] for line in result.outlines if "::test_" in line]
+    datasets = [i[0] for i in ids]
+    assert datasets == sorted(datasets)
+
+
+def test_values_dropped_after_last_use(workflow):
+    pytester = workflow(
+        """
+        import gc
+        import weakref
+        from chive import *
+
+        dataset = param("a", "b")
+        refs = []
+
+        class Big:
+            pass
+
+        @node
+        def big(dataset):
+            obj = Big()
+            refs.append(weakref.ref(obj))
+            return obj
+
+        @output
+        def test_use(big):
+            pass
+
+        @output
+        def test_zcheck(dataset):
+            gc.collect()
+            assert refs and all(ref() is None for ref in refs)
+        """
+    )
+    pytester.runpytest().assert_outcomes(passed=4)
+
+
+def test_profile_report(workflow):
+    import json
+
+    pytester = workflow(
+        """
+        from chive import *
+
+        dataset = param("a", "b")
+
+        @checkpoint
+        def data(dataset):
+            return dataset * 3
+
+        @node
+        def upper(data):
+            return data.upper()
+
+        @output
+        def test_out(upper):
+            pass
+        """
+    )
+
+    def statuses():
+        report = json.loads((pytester.path / "profile.json").read_text())
+        assert all(event["ph"] == "X" for event in report["traceEvents"])
+        return sorted((node["name"], node["status"]) for node in report["nodes"])
+
+    result = pytester.runpytest("--chive-profile-path", "profile.json")
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(["*chive slowest nodes*", "*2 miss, 2 node*"])
+    assert statuses() == [("data", "miss")] * 2 + [("upper", "node")] * 2
+    pytester.runpytest("--chive-profile-path", "profile.json").assert_outcomes(passed=2)
+    assert statuses() == [("data", "hit")] * 2 + [("upper", "node")] * 2
+
+    # The flag takes no value, so a path after it is still collected
+    (pytester.path / "profile.json").unlink()
+    result = pytester.runpytest("--chive-profile", "wf.py")
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(["*chive slowest nodes*"])
+    assert not (pytester.path / "profile.json").exists()
+
+
+def test_plan(workflow):
+    pytester = workflow(
+        """
+        from chive import *
+
+        dataset = param("a", "b")
+
+        @checkpoint
+        def raw(dataset):
+            return dataset * 3
+
+        @checkpoint
+        def data(raw):
+            return raw.upper()
+
+        @output
+        def test_out(data):
+            assert data[0] == "B"
+        """
+    )
+    pytester.runpytest("-k", "b").assert_outcomes(passed=1)
+    result = pytester.runpytest("--chive-plan")
+    result.assert_outcomes()
+    result.stdout.fnmatch_lines(
+        [
+            "*chive plan*",
+            "wf.py::test_out[[]a[]]: 0 load (0B), 2 compute",
+            "wf.py::test_out[[]b[]]: 1 load (*B), 0 compute",
+            "total for 2 tests: 1 load (*B), 2 compute",
+        ]
+    )
+
+
+def test_checkpoint_index_gc(workflow):
+    from chive.index import ChiveIndex
+
+    pytester = workflow(
+        """
+        from chive import *
+
+        size = param(1000, 2000, 3000)
+
+        @checkpoint
+        def blob(size):
+            return bytes(size)
+
+        @output
+        def test_out(blob):
+            pass
+        """
+    )
+    pytester.runpytest().assert_outcomes(passed=3)
+    entries = ChiveIndex(pytester.path / ".chive" / "index.sqlite").entries()
+    assert sorted(e.params["size"] for e in entries) == ["1000", "2000", "3000"]
+    assert all(e.code is not None for e in entries)
+
+    # Loading the smallest one makes it the most recently used
+    pytester.runpytest("-k", "1000").assert_outcomes(passed=1, deselected=2)
+    result = pytester.runpytest("--chive-gc", "3K")
+    assert result.ret == 0
+    result.stdout.fnmatch_lines(["chive gc: removed 2 checkpoints*kept 1*"])
+    assert len(list(pytester.path.glob(".chive/blob/*/blob.pkl"))) == 1
+    result = pytester.runpytest("-s")
+    result.assert_outcomes(passed=3)
+    assert sum("Loaded blob" in line for line in result.stdout.lines) == 1
+
+
+def test_parameter_sweeps(workflow):
+    from chive import sweep, zipped
+
+    grid = sweep(depth=range(1000), width=range(1000), sample=200, method="lhs")
+    assert grid.size == 10**6 and len(grid.table) <= 200
+    # Latin hypercube sampling spreads the samples over every axis
+    assert len({depth // 100 for depth, _ in grid.table}) == 10
+
+    pytester = workflow(
+        """
+        from chive import *
+
+        model = sweep(
+            zipped(lr=[0.1, 0.01], batch=[32, 64]),
+            depth=[1, 2, 3],
+            where=lambda lr, depth: lr < 0.05 or depth < 3,
+        )
+        dataset = param("a")
+
+        @checkpoint
+        def fit(lr, batch, depth, dataset):
+            return (lr, batch, depth, dataset)
+
+        @output
+        def test_fit(fit):
+            lr, batch, depth, dataset = fit
+            assert (lr, batch) in [(0.1, 32), (0.01, 64)]
+            assert lr < 0.05 or depth < 3
+
+        @output
+        def test_lr(lr):
+            pass
+        """
+    )
+    pytester.makefile(
+        ".yml",
+        cfg="""
+        parameters:
+          dataset: [a, b]
+        """,
+    )
+    # 5 allowed (lr, batch, depth) combinations for each of 2 datasets, and each lr once
+    pytester.runpytest("--chive_config", "cfg.yml").assert_outcomes(passed=12)
+
+    # A scalar is a single value, not a sequence of them
+    pytester.makefile(
+        ".yml",
+        scalar="""
+        parameters:
+          dataset: pbmc
+        """,
+    )
+    result = pytester.runpytest("--chive_config", "scalar.yml")
+    result.assert_outcomes(passed=7)
+    result = pytester.runpytest("--chive_config", "scalar.yml", "-k", "pbmc")
+    result.assert_outcomes(passed=5)
+
+
+def test_checkpoint_parameter_overrides(workflow):
+    pytester = workflow(
+        """
+        from chive import *
+
+        dataset = param("a", "b")
+        exp_name = param("x", "y", "z")
+        scale = param(1, 2)
+
+        @node
+        def label(exp_name):
+            return exp_name.upper()
+
+        @checkpoint
+        def preprocess(dataset, label):
+            print(f"preprocessing {dataset}")
+            return dataset * 2
+
+        @checkpoint
+        def reference(preprocess, scale):
+            print(f"reference at scale {scale}")
+            return preprocess * scale
+
+        @output
+        def test_out(preprocess, reference, dataset, exp_name, scale):
+            assert preprocess == dataset * 2
+            assert reference == dataset * 4
+        """
+    )
+    pytester.makefile(
+        ".yml",
+        cfg="""
+        checkpoints:
+          preprocess:
+            ignore: [exp_name]
+          reference:
+            pin:
+              scale: 2
+        """,
+    )
+    result = pytester.runpytest("-s", "--chive_config", "cfg.yml")
+    result.assert_outcomes(passed=12)
+    # One instance per dataset, shared by every exp_name and scale
+    assert sum("preprocessing" in line for line in result.stdout.lines) == 2
+    assert sum("reference at scale 2" in line for line in result.stdout.lines) == 2
+    result.stdout.no_fnmatch_line("*reference at scale 1*")
+    assert len(list(pytester.path.glob(".chive/preprocess/*/preprocess.pkl"))) == 2
+    assert len(list(pytester.path.glob(".chive/reference/*/reference.pkl"))) == 2
+
+
+def test_figure_renderer_skips_unchanged(tmp_path):
+    pytest.importorskip("matplotlib")
+    from matplotlib.figure import Figure
+    from chive.mpl import ChiveFigureRenderer
+
+    def figure(title):
+        fig = Figure()
+        ax = fig.add_subplot(111)
+        ax.plot([1, 2, 3])
+        ax.set_title(title)
+        return fig
+
+    path = tmp_path / "out" / "plot.png"
+    renderer = ChiveFigureRenderer(dpi=50)
+    # A new figure is only drawn, not hashed; it is once there is a file to compare
+    renderer.save(figure("line"), path)
+    assert path.exists() and not list(path.parent.glob(".*.sha256"))
+    renderer.save(figure("line"), path)
+    assert renderer.skipped == 0
+    renderer.save(figure("line"), path)
+    assert renderer.skipped == 1
+
+    renderer.save(figure("scatter"), path)
+    assert renderer.skipped == 1
+    other = ChiveFigureRenderer(dpi=100)
+    other.save(figure("scatter"), path)
+    assert other.skipped == 0
+    assert renderer.close() == []
+
+
+@pytest.mark.parametrize("workers", ["0", "1"])
+def test_figures_skipped_across_sessions(workflow, workers):
+    pytest.importorskip("matplotlib")
+    pytester = workflow(
+        """
+        from chive import *
+
+        dataset = param("d")
+        exp_name = param("e")
+
+        @output
+        def test_plot(ax):
+            ax.imshow([[0, 1], [1, 0]])
+            ax.plot([1, 2, 3], label="line")
+            ax.legend()
+        """
+    )
+    args = ["--savefig", "--savefig-dpi", "50", "--savefig-workers", workers]
+    pytester.runpytest_subprocess(*args).assert_outcomes(passed=1)
+    if workers == "0":
+        # Hashed in the second session, when there is a file to compare to
+        pytester.runpytest_subprocess(*args).assert_outcomes(passed=1)
+    (path,) = pytester.path.glob("chive_output/d/e/plot.png")
+    mtime = path.stat().st_mtime_ns
+    pytester.runpytest_subprocess(*args).assert_outcomes(passed=1)
+    assert path.stat().st_mtime_ns == mtime
+
+
+def test_remote_checkpoint_store(workflow, fake_store):
+    import shutil
+
+    pytester = workflow(
+        """
+        from chive import *
+
+        dataset = param("a", "b")
+
+        @checkpoint
+        def raw(dataset):
+            return dataset * 3
+
+        @checkpoint
+        def data(raw):
+            return raw.upper()
+
+        @output
+        def test_out(data, dataset):
+            assert data == dataset.upper() * 3
+        """
+    )
+    remote = ["--chive-remote", fake_store.url]
+    pytester.runpytest(*remote).assert_outcomes(passed=2)
+    assert len([key for key in fake_store.objects if key.startswith("data/")]) == 4
+
+    # A fresh checkout downloads only the checkpoints it needs
+    shutil.rmtree(pytester.path / ".chive")
+    result = pytester.runpytest("-s", *remote)
+    result.assert_outcomes(passed=2)
+    assert sum("Loaded data" in line for line in result.stdout.lines) == 2
+    result.stdout.no_fnmatch_line("*Loaded raw*")
+    assert len(list(pytester.path.glob(".chive/data/*/data.pkl"))) == 2
+    assert not list(pytester.path.glob(".chive/raw/*/raw.pkl"))
+
+    # An unreachable store leaves only the local checkpoints, with a warning
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        unreachable = f"http://127.0.0.1:{sock.getsockname()[1]}"
+    shutil.rmtree(pytester.path / ".chive")
+    result = pytester.runpytest("--chive-remote", unreachable)
+    result.assert_outcomes(passed=2, warnings=1)
+    result.stdout.fnmatch_lines(["*Checkpoint store*is unavailable*"])
+    assert len(list(pytester.path.glob(".chive/raw/*/raw.pkl"))) == 2
+    result = pytester.runpytest("-s", "--chive-remote", unreachable)
+    assert sum("Loaded data" in line for line in result.stdout.lines) == 2
+
+
+def test_streaming_checkpoint_resumes(workflow):
+    pytester = workflow(
+        """
+        import os
+        from chive import *
+
+        @checkpoint
+        def chunks():
+            for i in range(resumed_chunks(), 5):
+                print(f"computing chunk {i}")
+                if i == 3 and os.path.exists("interrupt"):
+                    raise RuntimeError("interrupted")
+                yield list(range(i + 1))
+
+        @node
+        def numbers():
+            yield from range(3)
+
+        @node
+        def total(chunks):
+            return sum(sum(chunk) for chunk in chunks)
+
+        def test_total(total, chunks, numbers):
+            assert isinstance(chunks, ChiveStream)
+            assert total == 20
+            assert list(numbers) == list(numbers) == [0, 1, 2]
+        """
+    )
+    (pytester.path / "interrupt").touch()
+    pytester.runpytest()
+    partial = list(pytester.path.glob(".chive/chunks/*/chunks.chunks.partial/*.pkl"))
+    assert len(partial) == 3
+
+    # The interrupted stream picks up after the chunks it saved
+    (pytester.path / "interrupt").unlink()
+    result = pytester.runpytest("-s")
+    result.assert_outcomes(passed=1)
+    computed = [line.split()[-1] for line in result.stdout.lines if "computing" in line]
+    assert computed == ["3", "4"]
+    assert len(list(pytester.path.glob(".chive/chunks/*/chunks.chunks/*.pkl"))) == 5
+
+    result = pytester.runpytest("-s")
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(["*Loaded chunks from checkpoint*"])
+    result.stdout.no_fnmatch_line("*computing*")
+
+
+def test_replicates(workflow):
+    pytester = workflow(
+        """
+        import os
+        import random
+        from chive import *
+
+        @checkpoint(replicate=4)
+        def draws():
+            i = current_replicate()
+            print(f"computing replicate {i}")
+            if i == 2 and os.path.exists("fail"):
+                raise RuntimeError("replicate failed")
+            return random.Random(i).random()
+
+        @node
+        def mean(draws):
+            return sum(draws) / len(draws)
+
+        def test_mean(mean, draws):
+            print(f"{len(draws)} draws")
+            assert draws == [random.Random(i).random() for i in range(len(draws))]
+            assert mean == sum(draws) / len(draws)
+        """
+    )
+    (pytester.path / "fail").touch()
+    pytester.runpytest("--chive-process-workers", "2").assert_outcomes(errors=1)
+    partial = pytester.path.glob(".chive/draws/*/draws.replicates.partial/*.pkl")
+    assert sorted(path.name for path in partial) == [
+        "000000.pkl",
+        "000001.pkl",
+        "000003.pkl",
+    ]
+
+    # Only the missing replicate is computed again
+    (pytester.path / "fail").unlink()
+    result = pytester.runpytest("-s", "--chive-process-workers", "2")
+    result.assert_outcomes(passed=1)
+    computed = [line.split()[-1] for line in result.stdout.lines if "computing" in line]
+    assert computed == ["2"]
+    assert len(list(pytester.path.glob(".chive/draws/*/draws.replicates/*.pkl"))) == 4
+
+    result = pytester.runpytest("-s")
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(["*Loaded draws from checkpoint*"])
+
+    # Changing the number of replicates only computes the ones that are new (a single
+    # one runs in this process, where its output is captured)
+    import shutil
+
+    source = (pytester.path / "wf.py").read_text()
+    for count, new in [(5, ["4"]), (3, [])]:
+        pytester.makepyfile(wf=source.replace("replicate=4", f"replicate={count}"))
+        # Same size and likely the same mtime, which the cached bytecode can't tell
+        shutil.rmtree(pytester.path / "__pycache__", ignore_errors=True)
+        result = pytester.runpytest("-s")
+        result.assert_outcomes(passed=1)
+        lines = result.stdout.lines
+        computed = [line.split()[-1] for line in lines if "computing" in line]
+        assert sorted(computed) == new
+        result.stdout.fnmatch_lines([f"*{count} draws*"])
+
+
+def test_none_values_and_cached_failures(workflow):
+    pytester = workflow(
+        """
+        import os
+        from chive import *
+
+        dataset = param("good", "bad")
+
+        @node
+        def setup():
+            print("running setup")
+
+        @checkpoint
+        def fit(dataset, setup):
+            print(f"fitting {dataset}")
+            if dataset == "bad" and not os.path.exists("fixed"):
+                raise ValueError("does not converge")
+            return dataset
+
+        def test_a(setup, fit):
+            assert setup is None
+
+        def test_b(setup, fit):
+            assert fit == "good" or os.path.exists("fixed")
+        """
+    )
+    flags = ["-s", "--chive-cache-failures"]
+    result = pytester.runpytest(*flags)
+    result.assert_outcomes(passed=2, errors=2)
+    # A node returning None is still only computed once
+    assert sum("running setup" in line for line in result.stdout.lines) == 1
+    assert sum("fitting bad" in line for line in result.stdout.lines) == 1
+    assert len(list(pytester.path.glob(".chive/fit/*/fit.failed.json"))) == 1
+
+    # The failure is reported without computing the node again
+    result = pytester.runpytest(*flags)
+    result.assert_outcomes(passed=2, errors=2)
+    result.stdout.no_fnmatch_line("*fitting*")
+    result.stdout.fnmatch_lines(["*fit failed when last computed*does not converge*"])
+
+    (pytester.path / "fixed").touch()
+    result = pytester.runpytest(*flags, "--chive-retry-failures")
+    result.assert_outcomes(passed=4)
+    assert not list(pytester.path.glob(".chive/fit/*/fit.failed.json"))
+
+
+def test_process_executor_maps_result(workflow):
+    pytester = workflow(
+        """
+        import mmap
+        import os
+        import pickle
+        from chive import *
+
+        class Blob:
+            def __init__(self, data):
+                self.data = data
+
+            def __reduce_ex__(self, protocol):
+                return Blob, (pickle.PickleBuffer(self.data),)
+
+        @checkpoint(executor="process")
+        def blob():
+            return os.getpid(), Blob(bytearray(b"x" * 100_000))
+
+        def test_blob(blob):
+            pid, blob = blob
+            assert pid != os.getpid()
+            # Handed over from the worker's checkpoint without a copy
+            assert isinstance(blob.data.obj, mmap.mmap)
+            assert bytes(blob.data) == b"x" * 100_000
+        """
+    )
+    pytester.runpytest("--chive-process-workers", "1").assert_outcomes(passed=1)
+    assert len(list(pytester.path.glob(".chive/blob/*/blob.pkl5"))) == 1
+    result = pytester.runpytest("-s")
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(["*Loaded blob from checkpoint*"])
+
+
+def test_prefetch_loads_ahead(workflow):
+    pytester = workflow(
+        """
+        import threading
+        from chive import *
+
+        dataset = param(*range(4))
+
+        def _loaded(value):
+            return value, threading.current_thread().name
+
+        class Value:
+            def __init__(self, value):
+                self.value = value
+
+            def __reduce__(self):
+                return _loaded, (self.value,)
+
+        @checkpoint
+        def data(dataset):
+            return Value(dataset)
+
+        def test_data(data, dataset):
+            value, thread = data if isinstance(data, tuple) else (data.value, None)
+            assert value == dataset
+            print(f"loaded {dataset} in {thread}")
+        """
+    )
+    pytester.runpytest().assert_outcomes(passed=4)
+    result = pytester.runpytest("-s", "--chive-prefetch", "2")
+    result.assert_outcomes(passed=4)
+    threads = [line.split()[-1] for line in result.stdout.lines if "loaded" in line]
+    assert len(threads) == 4
+    assert all(thread.startswith("chive-prefetch") for thread in threads)
+
+
+def test_prefetch_budget_reserved_at_submit(tmp_path):
+    from chive.io import ChiveIO
+    from chive.prefetch import ChivePrefetcher
+
+    chive_io = ChiveIO()
+    names = [str(tmp_path / f"node{i}") for i in range(3)]
+    for name in names:
+        chive_io.save(list(range(1000)), name)
+    prefetcher = ChivePrefetcher(chive_io, depth=2, max_bytes=1)
+    try:
+        prefetcher.plan((f"test{i}", [name]) for i, name in enumerate(names))
+        # The first load alone takes up the budget, before any of them finish
+        prefetcher.advance("test0")
+        assert list(prefetcher.staged) == names[:1]
+        assert prefetcher.take(names[0]) == (True, list(range(1000)))
+        prefetcher.advance("test1")
+        assert list(prefetcher.staged) == names[1:2]
+    finally:
+        prefetcher.shutdown()
+
+
+def test_incremental_outputs(workflow):
+    import pickle
+
+    pytester = workflow(
+        """
+        from chive import *
+
+        dataset = param("a", "b")
+
+        @checkpoint
+        def data(dataset):
+            return dataset * 2
+
+        @output
+        def test_out(data, dataset):
+            print(f"checking {dataset}")
+            assert data.startswith(dataset)
+
+        @output
+        def test_fails(data):
+            assert not data
+        """
+    )
+    flags = ["-s", "--chive-incremental"]
+    pytester.runpytest(*flags).assert_outcomes(passed=2, failed=2)
+
+    # Passing outputs with unchanged inputs are skipped, failing ones run again
+    result = pytester.runpytest(*flags)
+    result.assert_outcomes(skipped=2, failed=2)
+    result.stdout.no_fnmatch_line("*checking*")
+    pytester.runpytest("-s").assert_outcomes(passed=2, failed=2)
+
+    # A checkpoint with new contents reruns the output that reads it
+    path = next(pytester.path.glob(".chive/data/*/data.pkl"))
+    path.write_bytes(pickle.dumps(pickle.loads(path.read_bytes()) * 2))
+    result = pytester.runpytest(*flags)
+    result.assert_outcomes(passed=1, skipped=1, failed=2)
+    pytester.runpytest(*flags).assert_outcomes(skipped=2, failed=2)
+
+
+def test_checkpoint_leases(tmp_path):
+    import json
+    import os
+    import socket
+    from chive.locks import ChiveLease, ChiveLocks
+
+    locks = ChiveLocks(ttl=60)
+    try:
+        lease = locks.acquire(tmp_path / "node", ready=lambda: False)
+        assert lease is not None and lease.path.exists()
+        assert not ChiveLease(tmp_path / "node").try_acquire()
+        locks.release(lease)
+        assert not lease.path.exists()
+
+        # A lock left behind by a process that no longer exists is broken
+        dead = subprocess.Popen(["python", "-c", "pass"])
+        dead.wait()
+        lock_path = tmp_path / "node.lock"
+        lock_path.write_text(json.dumps({"host": socket.gethostname(), "pid": dead.pid}))
+        assert ChiveLease(tmp_path / "node").is_stale()
+        lease = locks.acquire(tmp_path / "node", ready=lambda: False)
+        assert json.loads(lock_path.read_text())["pid"] == os.getpid()
+        locks.release(lease)
+
+        # Breaking a lock that turns out to be live, e.g. one taken after another
+        # process broke the stale lock first, leaves it in place
+        lease = locks.acquire(tmp_path / "node", ready=lambda: False)
+        owner = lock_path.read_text()
+        ChiveLease(tmp_path / "node").break_stale()
+        assert lock_path.read_text() == owner
+        assert not list(tmp_path.glob("*.stale"))
+        locks.release(lease)
+
+        # Another process's committed result is used instead of computing
+        assert locks.acquire(tmp_path / "node", ready=lambda: True) is None
+    finally:
+        locks.shutdown()
+
+
+def test_background_save_errors_reported(workflow):
+    pytester = workflow(
+        """
+        from chive import *
+
+        @checkpoint
+        def unpicklable():
+            return lambda: None
+
+        @output
+        def test_out(unpicklable):
+            assert callable(unpicklable)
+        """
+    )
+    result = pytester.runpytest("--chive-writers", "1")
+    result.assert_outcomes(passed=1)
+    assert result.ret == pytest.ExitCode.TESTS_FAILED
+    result.stdout.fnmatch_lines(["*chive checkpoint errors*", "*unpicklable*"])
+
+
+def test_background_save_serializes_on_writer_thread(workflow):
+    pytester = workflow(
+        """
+        import threading
+        from chive import *
+
+        class Value:
+            def __reduce__(self):
+                print("pickled on", threading.current_thread().name)
+                return int, (1,)
+
+        @checkpoint
+        def data():
+            return Value()
+
+        @output
+        def test_out(data):
+            assert isinstance(data, Value)
+        """
+    )
+    result = pytester.runpytest("-s", "--chive-writers", "1")
+    result.assert_outcomes(passed=1)
+    threads = [line.split()[-1] for line in result.stdout.lines if "pickled" in line]
+    assert len(threads) == 1 and threads[0].startswith("chive-writer")
+
+
+def test_default_save_unaffected_by_later_mutation(workflow):
+    pytester = workflow(
+        """
+        import time
+        from chive import *
+
+        class SlowList(list):
+            def __reduce__(self):
+                time.sleep(0.2)
+                return list, (list(self),)
+
+        @checkpoint
+        def data():
+            return SlowList([1, 2, 3])
+
+        @node
+        def centered(data):
+            data[:] = [x - 2 for x in data]
+            return data
+
+        @output
+        def test_out(centered):
+            assert centered == [-1, 0, 1]
+        """
+    )
+    result = pytester.runpytest()
+    result.assert_outcomes(passed=1)
+
+    import pickle
+
+    (path,) = pytester.path.glob(".chive/data/*/data.pkl")
+    assert pickle.loads(path.read_bytes()) == [1, 2, 3]
+
+
 if __name__ == "__main__":
     import pytest
 